@@ -0,0 +1,255 @@
+import hashlib
+import time
+from collections import namedtuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework.response import Response
+
+from .utils import get_shopping_cart
+from recipes.models import Cart, Favorite
+from users.models import Subscription
+
+SHOPPING_CART_VERSION_KEY = 'shopping_cart_version:{}'
+SHOPPING_CART_KEY = 'shopping_cart:{}:{}'
+USER_STATE_VERSION_KEY = 'user_state_version:{}'
+USER_STATE_KEY = 'user_state:{}:{}'
+GENERATION_KEY = 'generation:{}'
+RESPONSE_KEY = 'response:{}'
+
+UserState = namedtuple('UserState', ['favorites', 'cart', 'subscriptions'])
+
+
+def get_version(key):
+    """
+    Текущая версия данных, хранящаяся под ключом key.
+
+    Версия - случайный токен, поэтому после очистки кэша
+    или перезапуска старые ETag клиентов не совпадут с новыми.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def get_shopping_cart_version(user_id):
+    """
+    Текущая версия корзины покупок пользователя.
+    """
+    return get_version(SHOPPING_CART_VERSION_KEY.format(user_id))
+
+
+def get_shopping_cart_snapshot(user, version):
+    """
+    Список покупок пользователя для указанной версии корзины.
+
+    Список вычисляется запросом к БД только при первом обращении
+    к версии, далее читается из кэша.
+    """
+    key = SHOPPING_CART_KEY.format(user.id, version)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(get_shopping_cart(user))
+        cache.set(key, rows, settings.SHOPPING_CART_CACHE_TIMEOUT)
+    return rows
+
+
+def invalidate_shopping_cart(user_ids):
+    """
+    Смена версии корзины покупок пользователей после фиксации транзакции.
+    """
+    keys = [SHOPPING_CART_VERSION_KEY.format(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_user_state(user):
+    """
+    Версия и состояние пользователя для ответов о рецептах:
+    множества id избранных рецептов, рецептов в корзине
+    и авторов, на которых подписан пользователь.
+
+    Состояние загружается тремя запросами при первом обращении
+    к версии, далее читается из кэша.
+    """
+    version = get_version(USER_STATE_VERSION_KEY.format(user.id))
+    key = USER_STATE_KEY.format(user.id, version)
+    state = cache.get(key)
+    if state is None:
+        state = UserState(
+            favorites=set(Favorite.objects.filter(user=user).values_list(
+                'recipe_id', flat=True
+            )),
+            cart=set(Cart.objects.filter(user=user).values_list(
+                'recipe_id', flat=True
+            )),
+            subscriptions=set(Subscription.objects.filter(
+                user=user
+            ).values_list('author_id', flat=True)),
+        )
+        cache.set(key, state, settings.RESPONSE_CACHE_TIMEOUT)
+    return version, state
+
+
+def invalidate_user_state(user_ids):
+    """
+    Смена версии состояния пользователей после фиксации транзакции.
+    """
+    keys = [USER_STATE_VERSION_KEY.format(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_generations(scopes):
+    """
+    Текущие поколения данных scopes ('recipes', 'tags', ...).
+
+    Поколение - случайный токен, который сбрасывается при изменении
+    данных, поэтому ключи кэша, построенные из поколений,
+    после изменения перестают совпадать.
+    """
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid4().hex, None)
+        generations.update(cache.get_many(missing))
+    return [generations[key] for key in keys]
+
+
+def invalidate_generations(scopes):
+    """
+    Смена поколений данных scopes после фиксации транзакции.
+    """
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class ResponseCacheMixin:
+    """
+    Кэширование ответов list и retrieve, общих для всех пользователей.
+
+    Ключ ответа строится из схемы, хоста и адреса (ответ содержит
+    абсолютные ссылки на соседние страницы), параметров запроса
+    (в том числе номера страницы) и поколений данных, от которых
+    зависит ответ (cache_scopes или get_cache_scopes для запроса).
+    Общий ответ строится как для анонимного пользователя;
+    если use_user_state установлен, для авторизованного пользователя
+    поверх него накладывается его состояние (apply_user_state),
+    после чего из ответа удаляются служебные поля, которые нужны
+    только для наложения (remove_overlay_fields).
+    Запросы, результат которых зависит от пользователя
+    (is_shared_request возвращает False), не кэшируются.
+
+    Ответ отдается с ETag (для авторизованного пользователя - с учетом
+    версии его состояния) и Last-Modified; на условный запрос
+    с совпадающим значением возвращается 304.
+    """
+    cache_scopes = ()
+    use_user_state = False
+    shared_response = False
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def is_shared_request(self, request):
+        return True
+
+    def get_cache_scopes(self, request):
+        return self.cache_scopes
+
+    def apply_user_state(self, data, state):
+        return data
+
+    def remove_overlay_fields(self, data, request):
+        return data
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['shared_response'] = self.shared_response
+        return context
+
+    def get_response_user(self):
+        """
+        Пользователь, для которого строится ответ: анонимный
+        для общего ответа, иначе автор запроса.
+        """
+        if self.shared_response:
+            return AnonymousUser()
+        return self.request.user
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        user = request.user
+        if user.is_authenticated and not self.is_shared_request(request):
+            return handler(request, *args, **kwargs)
+        self.shared_response = True
+        query = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+        )
+        digest = hashlib.md5(repr([
+            request.scheme,
+            request.get_host(),
+            request.path,
+            query,
+            get_generations(self.get_cache_scopes(request)),
+        ]).encode()).hexdigest()
+        state = None
+        if user.is_authenticated and self.use_user_state:
+            version, state = get_user_state(user)
+            etag = f'"{digest}-{version}"'
+        else:
+            etag = f'"{digest}"'
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return self.get_not_modified_response(etag)
+        key = RESPONSE_KEY.format(digest)
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data, last_modified = response.data, int(time.time())
+            cache.set(
+                key,
+                (data, last_modified),
+                settings.RESPONSE_CACHE_TIMEOUT
+            )
+        else:
+            data, last_modified = cached
+            modified_since = parse_http_date_safe(
+                request.META.get('HTTP_IF_MODIFIED_SINCE', '')
+            )
+            if (state is None and modified_since is not None
+                    and last_modified <= modified_since):
+                return self.get_not_modified_response(etag)
+        if state is not None:
+            data = self.apply_user_state(data, state)
+        data = self.remove_overlay_fields(data, request)
+        response = Response(data)
+        response['ETag'] = etag
+        if state is None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def get_not_modified_response(self, etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
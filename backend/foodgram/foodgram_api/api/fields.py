@@ -1,4 +1,12 @@
-from rest_framework.serializers import ImageField
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.serializers import (ImageField, ReadOnlyField,
+                                        ValidationError)
+
+from recipes.images import get_srcset, get_thumb_url
+
+IMAGE_TOO_LARGE = 'Image file is too large (max {} bytes).'
 
 
 class ImageFieldForRecipeRead(ImageField):
@@ -16,3 +24,73 @@ class ImageFieldForRecipeRead(ImageField):
             return url
 
         return value.name
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Изображение рецепта: строка base64 или файл из запроса
+    multipart/form-data, с ограничением размера файла
+    (RECIPE_IMAGE_MAX_SIZE байт) и числа пикселей
+    (RECIPE_IMAGE_MAX_PIXELS). Размер файла проверяется
+    до декодирования base64.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            image = self.file_to_internal_value(data)
+        else:
+            if isinstance(data, str):
+                payload = data.split(';base64,')[-1]
+                self.check_size(len(payload) * 3 // 4)
+            image = super().to_internal_value(data)
+        width, height = image.image.size
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Image is too large (max {} pixels).'.format(
+                    settings.RECIPE_IMAGE_MAX_PIXELS
+                )
+            )
+        return image
+
+    def file_to_internal_value(self, data):
+        """
+        Проверка загруженного файла. Файл переименовывается так же,
+        как изображение из base64, имя от клиента не используется.
+        """
+        self.check_size(data.size)
+        image = ImageField.to_internal_value(self, data)
+        extension = image.image.format.lower()
+        if extension not in self.ALLOWED_TYPES:
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        if extension == 'jpeg':
+            extension = 'jpg'
+        image.name = '{}.{}'.format(self.get_file_name(image), extension)
+        return image
+
+    @staticmethod
+    def check_size(size):
+        if size > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise ValidationError(
+                IMAGE_TOO_LARGE.format(settings.RECIPE_IMAGE_MAX_SIZE)
+            )
+
+
+class RecipeImageThumbField(ReadOnlyField):
+    """
+    Адрес уменьшенной копии изображения рецепта.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, value):
+        return get_thumb_url(value)
+
+
+class RecipeImageSrcsetField(RecipeImageThumbField):
+    """
+    Набор WebP-вариантов изображения рецепта для атрибута srcset.
+    """
+
+    def to_representation(self, value):
+        return get_srcset(value)
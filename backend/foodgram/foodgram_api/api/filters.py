@@ -1,6 +1,25 @@
+from django import forms
+from django.db.models import Exists, F, OuterRef
 from django_filters import rest_framework as filt
+from rest_framework.exceptions import ValidationError
 
-from recipes.models import Ingredient, Recipe
+from .indexes import tag_index
+from recipes.models import Recipe
+from recipes.search import search_recipes
+
+
+class TagSlugsField(forms.Field):
+    """
+    Список значений повторяющегося параметра (?tags=a&tags=b).
+    """
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        return [slug for slug in value or [] if slug]
+
+
+class TagSlugsFilter(filt.Filter):
+    field_class = TagSlugsField
 
 
 class RecipeFilter(filt.FilterSet):
@@ -10,9 +29,12 @@ class RecipeFilter(filt.FilterSet):
     author = filt.NumberFilter(
         field_name='author',
     )
-    tags = filt.AllValuesMultipleFilter(
-        field_name='tags__slug',
-        lookup_expr='istartswith',
+    tags = TagSlugsFilter(
+        method='filter_tags',
+    )
+    tags_mode = filt.ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')),
+        method='filter_tags_mode',
     )
     is_in_shopping_cart = filt.NumberFilter(
         field_name='is_in_shopping_cart',
@@ -22,33 +44,96 @@ class RecipeFilter(filt.FilterSet):
         field_name='is_favorited',
         method='filter_is_favorited',
     )
+    search = filt.CharFilter(
+        method='filter_search',
+    )
+    ordering = filt.ChoiceFilter(
+        choices=(('popular', 'popular'), ('trending', 'trending')),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
         fields = ('author', 'tags')
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
         if value == 1:
-            return queryset.filter(cart_recipe__user=user)
+            return self.with_user_flags(queryset).filter(
+                is_in_shopping_cart=True
+            )
         return queryset
 
     def filter_is_favorited(self, queryset, name, value):
-        user = self.request.user
         if value == 1:
-            return queryset.filter(favorite_recipe__user=user)
+            return self.with_user_flags(queryset).filter(is_favorited=True)
         return queryset
 
+    def with_user_flags(self, queryset):
+        """
+        Аннотации is_favorited и is_in_shopping_cart, если их нет
+        в queryset (они не загружаются, когда поля не выбраны в ?fields=).
+        """
+        if 'is_favorited' in queryset.query.annotations:
+            return queryset
+        return queryset.with_user_flags(self.request.user)
 
-class IngredientsFilter(filt.FilterSet):
-    """
-    Фильтр для ингредиентов.
-    """
-    name = filt.CharFilter(
-        field_name='name',
-        lookup_expr='istartswith',
-    )
+    def filter_search(self, queryset, name, value):
+        """
+        Поиск с сортировкой по релевантности; курсор страниц построен
+        по дате публикации и не совместим с этой сортировкой.
+        """
+        if value.split() and 'cursor' in self.request.query_params:
+            raise ValidationError(
+                {'search': 'Search is not supported with a cursor.'}
+            )
+        return search_recipes(queryset, value)
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+    def filter_tags(self, queryset, name, value):
+        """
+        Рецепты с любым (?tags_mode=any, по умолчанию) или со всеми
+        (?tags_mode=all) тэгами из списка slug.
+
+        Slug переводятся в id по индексу тэгов в памяти процесса,
+        условие проверяется подзапросами EXISTS к таблице связи
+        рецептов и тэгов, поэтому рецепты не дублируются и DISTINCT
+        не нужен.
+        """
+        if not value:
+            return queryset
+        ids = tag_index.get_ids(value)
+        unknown = [slug for slug in value if slug not in ids]
+        if unknown:
+            raise ValidationError({
+                'tags': [f'Select a valid choice. {unknown[0]} is not one '
+                         f'of the available choices.']
+            })
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk')
+        )
+        if self.form.cleaned_data.get('tags_mode') != 'all':
+            return queryset.annotate(has_tags=Exists(
+                recipe_tags.filter(tag_id__in=set(ids.values()))
+            )).filter(has_tags=True)
+        conditions = {
+            f'has_tag_{tag_id}': Exists(recipe_tags.filter(tag_id=tag_id))
+            for tag_id in set(ids.values())
+        }
+        return queryset.annotate(**conditions).filter(
+            **{name: True for name in conditions}
+        )
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        """
+        Сортировка по оценке популярности из таблицы рейтинга
+        (команда rankings); рецепты без оценки - в конце.
+        """
+        if 'cursor' in self.request.query_params:
+            raise ValidationError(
+                {'ordering': 'Ordering is not supported with a cursor.'}
+            )
+        return queryset.order_by(
+            F(f'ranking__{value}').desc(nulls_last=True), '-pub_time', '-id'
+        )
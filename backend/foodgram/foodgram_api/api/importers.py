@@ -0,0 +1,253 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from .cache import invalidate_generations
+
+CHUNK_SIZE = 64 * 1024
+FORMATS = ('csv', 'json', 'ndjson')
+
+
+def iter_json(stream):
+    """
+    Последовательное чтение элементов JSON-массива из потока
+    без загрузки всего файла в память.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    state = 'start'
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                if state != 'start':
+                    raise ValueError('Unexpected end of JSON array')
+                return
+            buffer = chunk
+            continue
+        if state == 'start':
+            if buffer[0] != '[':
+                raise ValueError('JSON array expected')
+            buffer = buffer[1:]
+            state = 'value'
+        elif buffer[0] == ']':
+            return
+        elif state == 'separator':
+            if buffer[0] != ',':
+                raise ValueError('Invalid JSON array separator')
+            buffer = buffer[1:]
+            state = 'value'
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    raise
+                buffer += chunk
+                continue
+            yield value
+            buffer = buffer[end:]
+            state = 'separator'
+
+
+def iter_ndjson(stream):
+    """
+    Чтение JSON-объектов, записанных по одному в строке.
+    """
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_csv(stream, fields):
+    """
+    Чтение строк CSV в виде словарей с ключами fields.
+    Первая строка пропускается, если она совпадает с fields.
+    """
+    reader = csv.reader(stream)
+    for number, row in enumerate(reader):
+        if number == 0 and tuple(row) == tuple(fields):
+            continue
+        if row:
+            yield dict(zip(fields, row))
+
+
+def detect_format(path, file_format):
+    if file_format:
+        return file_format
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension in FORMATS:
+        return extension
+    return 'json'
+
+
+def iter_records(path, file_format, fields):
+    """
+    Записи из файла path (или stdin, если path равен '-')
+    в формате csv, json или ndjson.
+    """
+    file_format = detect_format(path, file_format)
+    if path == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    else:
+        stream = open(path, encoding='utf-8', newline='')
+    with stream:
+        if file_format == 'csv':
+            records = iter_csv(stream, fields)
+        elif file_format == 'ndjson':
+            records = iter_ndjson(stream)
+        else:
+            records = iter_json(stream)
+        for record in records:
+            yield clean_record(record, fields)
+
+
+def clean_record(record, fields):
+    """
+    Значения полей fields записи record без пробелов по краям.
+    Запись должна быть объектом со строковыми значениями полей.
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f'Object expected, got {record!r}')
+    values = {}
+    for field in fields:
+        value = record[field]
+        if not isinstance(value, str):
+            raise ValueError(f'{field}: string expected, got {value!r}')
+        values[field] = value.strip()
+    return values
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def bulk_import(model, records, batch_size):
+    """
+    Вставка записей пачками, записи с уже существующими
+    уникальными ключами пропускаются.
+    """
+    count = 0
+    for batch in batches(records, batch_size):
+        model.objects.bulk_create(
+            [model(**record) for record in batch],
+            ignore_conflicts=True
+        )
+        count += len(batch)
+    return count
+
+
+def copy_import(model, records, batch_size):
+    """
+    Загрузка записей в PostgreSQL через COPY во временную таблицу
+    и перенос в основную таблицу одним INSERT ... ON CONFLICT DO NOTHING:
+    как и при bulk_import, записи с уже существующими уникальными
+    ключами (в том числе повторяющиеся в файле) пропускаются.
+    """
+    table = model._meta.db_table
+    fields = None
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for batch in batches(records, batch_size):
+            if fields is None:
+                fields = list(batch[0])
+                columns = ', '.join(fields)
+                cursor.execute(
+                    f'CREATE TEMP TABLE import_staging ON COMMIT DROP AS '
+                    f'SELECT {columns} FROM {table} WITH NO DATA'
+                )
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows(
+                [record[field] for field in fields] for record in batch
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY import_staging ({columns}) FROM STDIN WITH CSV',
+                buffer
+            )
+            count += len(batch)
+        if fields is not None:
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {columns} FROM import_staging '
+                f'ON CONFLICT DO NOTHING'
+            )
+    return count
+
+
+class CatalogImporter:
+    """
+    Загрузка справочника (ингредиентов, тэгов) в базу данных.
+
+    model - модель справочника,
+    fields - загружаемые поля.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+
+    def run(self, path, file_format=None, batch_size=1000, use_copy=None):
+        if use_copy is None:
+            use_copy = connection.vendor == 'postgresql'
+        records = iter_records(path, file_format, self.fields)
+        before = self.model.objects.count()
+        start = time.perf_counter()
+        if use_copy:
+            count = copy_import(self.model, records, batch_size)
+        else:
+            count = bulk_import(self.model, records, batch_size)
+        elapsed = time.perf_counter() - start
+        created = self.model.objects.count() - before
+        return count, created, elapsed
+
+
+class ImportCommand(BaseCommand):
+    """
+    Базовая команда загрузки справочника из файла или stdin.
+    """
+    importer = None
+    default_path = None
+    cache_scopes = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=self.default_path,
+            help="File to import, '-' reads from stdin"
+        )
+        parser.add_argument('--format', choices=FORMATS,
+                            help='File format, detected by extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Do not use COPY on PostgreSQL')
+
+    def handle(self, *args, **options):
+        try:
+            count, created, elapsed = self.importer.run(
+                options['path'],
+                file_format=options['format'],
+                batch_size=options['batch_size'],
+                use_copy=False if options['no_copy'] else None,
+            )
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(error)
+        invalidate_generations(self.cache_scopes)
+        rate = count / elapsed if elapsed else count
+        self.stdout.write(
+            f'{count} rows read, {created} created '
+            f'in {elapsed:.2f}s ({rate:.0f} rows/sec)'
+        )
@@ -0,0 +1,268 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Ingredient, RecipesIngredient, Tag
+
+
+class VersionedIndex:
+    """
+    Базовый класс индекса в памяти процесса.
+
+    Версия индекса хранится в общем кэше. Изменение данных сбрасывает
+    версию (invalidate), и каждый процесс перестраивает свою копию
+    индекса из БД при первом обращении после этого.
+    """
+    version_key = None
+
+    def __init__(self):
+        self.version = None
+        self.lock = Lock()
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def ensure_fresh(self):
+        version = self.get_version()
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                self.build()
+                self.version = version
+
+    def invalidate(self):
+        transaction.on_commit(lambda: cache.delete(self.version_key))
+
+    def build(self):
+        raise NotImplementedError
+
+
+class IngredientPrefixIndex(VersionedIndex):
+    """
+    Поиск ингредиентов по началу названия (без учета регистра)
+    двоичным поиском по отсортированному списку названий.
+    """
+    version_key = 'ingredient_index_version'
+
+    def __init__(self):
+        super().__init__()
+        self.data = ([], [])
+
+    def build(self):
+        ingredients = sorted(
+            (name.lower(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        self.data = (
+            [ingredient[0] for ingredient in ingredients],
+            [
+                {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+                for _, pk, name, measurement_unit in ingredients
+            ],
+        )
+
+    def search(self, name, contains=False):
+        """
+        Ингредиенты, название которых начинается с name.
+
+        При contains=True после них добавляются ингредиенты,
+        название которых содержит name не в начале.
+        """
+        self.ensure_fresh()
+        keys, ingredients = self.data
+        prefix = name.lower()
+        start = position = bisect_left(keys, prefix)
+        while position < len(keys) and keys[position].startswith(prefix):
+            position += 1
+        result = ingredients[start:position]
+        if contains:
+            result += [
+                ingredient for key, ingredient in zip(keys, ingredients)
+                if prefix in key and not key.startswith(prefix)
+            ]
+        return result
+
+
+class TagSlugIndex(VersionedIndex):
+    """
+    Соответствие slug -> id тэгов для фильтрации рецептов
+    по тэгам без обращения к таблице тэгов.
+    """
+    version_key = 'tag_index_version'
+
+    def __init__(self):
+        super().__init__()
+        self.ids = {}
+
+    def build(self):
+        self.ids = dict(Tag.objects.values_list('slug', 'id'))
+
+    def get_ids(self, slugs):
+        """
+        Словарь {slug: id} для slugs; неизвестные slug пропускаются.
+        """
+        self.ensure_fresh()
+        ids = self.ids
+        return {slug: ids[slug] for slug in slugs if slug in ids}
+
+
+class RecipeIngredientIndex(VersionedIndex):
+    """
+    Инвертированный индекс "ингредиент -> рецепты" для подбора рецептов
+    по имеющимся у пользователя ингредиентам.
+
+    Списки рецептов хранятся в компактных массивах array('I').
+    Изменения рецептов не сбрасывают индекс целиком: номера измененных
+    рецептов записываются в общий кэш под последовательными номерами,
+    и каждый процесс перечитывает из БД состав только этих рецептов.
+    Если часть журнала изменений вытеснена из кэша,
+    индекс строится заново.
+    """
+    version_key = 'recipe_ingredient_index_version'
+    changes_key = 'recipe_ingredient_index_changes:{}'
+    change_key = 'recipe_ingredient_index_change:{}:{}'
+    CHANGE_TIMEOUT = 60 * 60 * 24
+
+    def __init__(self):
+        super().__init__()
+        self.applied = 0
+        self.recipes = {}
+        self.postings = {}
+
+    def get_changes_count(self, version):
+        return cache.get(self.changes_key.format(version)) or 0
+
+    def build(self):
+        self.applied = self.get_changes_count(self.get_version())
+        rows = RecipesIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        )
+        recipes = defaultdict(list)
+        for recipe_id, ingredient_id in rows.iterator():
+            recipes[recipe_id].append(ingredient_id)
+        postings = defaultdict(lambda: array('I'))
+        for recipe_id, ingredients in recipes.items():
+            for ingredient_id in ingredients:
+                postings[ingredient_id].append(recipe_id)
+        self.recipes = {
+            recipe_id: array('I', ingredients)
+            for recipe_id, ingredients in recipes.items()
+        }
+        self.postings = dict(postings)
+
+    def ensure_fresh(self):
+        super().ensure_fresh()
+        count = self.get_changes_count(self.version)
+        if count <= self.applied:
+            return
+        with self.lock:
+            if count <= self.applied:
+                return
+            recipe_ids = set()
+            for number in range(self.applied + 1, count + 1):
+                key = self.change_key.format(self.version, number)
+                change = cache.get(key)
+                if change is None:
+                    self.build()
+                    return
+                recipe_ids.update(change)
+            self.reload(recipe_ids)
+            self.applied = count
+
+    def reload(self, recipe_ids):
+        """
+        Замена состава рецептов recipe_ids данными из БД.
+        Списки рецептов заменяются новыми массивами, поэтому
+        одновременный поиск в других потоках видит согласованные данные.
+        """
+        recipes = defaultdict(list)
+        for recipe_id, ingredient_id in RecipesIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            recipes[recipe_id].append(ingredient_id)
+        changed = set()
+        for recipe_id in recipe_ids:
+            changed.update(self.recipes.get(recipe_id, ()))
+            changed.update(recipes.get(recipe_id, ()))
+        for ingredient_id in changed:
+            posting = array('I', (
+                recipe_id
+                for recipe_id in self.postings.get(ingredient_id, ())
+                if recipe_id not in recipe_ids
+            ))
+            posting.extend(
+                recipe_id for recipe_id in recipe_ids
+                if ingredient_id in recipes.get(recipe_id, ())
+            )
+            self.postings[ingredient_id] = posting
+        for recipe_id in recipe_ids:
+            if recipe_id in recipes:
+                self.recipes[recipe_id] = array('I', recipes[recipe_id])
+            else:
+                self.recipes.pop(recipe_id, None)
+
+    def update(self, recipe_ids):
+        """
+        Запись измененных рецептов в журнал после фиксации транзакции.
+        """
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+
+        def record():
+            version = self.get_version()
+            key = self.changes_key.format(version)
+            cache.add(key, 0, None)
+            number = cache.incr(key)
+            cache.set(
+                self.change_key.format(version, number),
+                recipe_ids,
+                self.CHANGE_TIMEOUT
+            )
+
+        transaction.on_commit(record)
+
+    def match(self, ingredient_ids, limit):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов
+        ingredient_ids, по убыванию доли имеющихся ингредиентов:
+        список (id рецепта, доля, множество недостающих ингредиентов)
+        длиной не более limit.
+        """
+        self.ensure_fresh()
+        ingredient_ids = set(ingredient_ids)
+        postings, recipes = self.postings, self.recipes
+        counts = Counter()
+        for ingredient_id in ingredient_ids:
+            counts.update(postings.get(ingredient_id, ()))
+        ranked = []
+        for recipe_id, count in counts.items():
+            ingredients = recipes.get(recipe_id)
+            if ingredients:
+                ranked.append((count / len(ingredients), count, recipe_id))
+        return [
+            (
+                recipe_id,
+                coverage,
+                set(recipes.get(recipe_id, ())) - ingredient_ids,
+            )
+            for coverage, _, recipe_id in heapq.nlargest(limit, ranked)
+        ]
+
+
+ingredient_index = IngredientPrefixIndex()
+tag_index = TagSlugIndex()
+recipe_ingredient_index = RecipeIngredientIndex()
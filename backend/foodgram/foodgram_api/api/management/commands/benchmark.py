@@ -0,0 +1,437 @@
+import csv
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.runner import DiscoverRunner
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.test import APIClient
+
+from api.cache import get_user_state
+from api.indexes import (ingredient_index, recipe_ingredient_index,
+                         tag_index)
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipesIngredient, Tag)
+from users.models import Subscription, User
+
+BUDGET_FILE = os.path.join(settings.DATA_DIR, 'query_budget.json')
+
+IMAGE = (
+    'data:image/gif;base64,'
+    'R0lGODlhAQABAIAAAAUEBAAAACwAAAAAAQABAAACAkQBADs='
+)
+
+PASSWORD = 'benchmark'
+
+ANONYMOUS_SCENARIOS = (
+    'users-list',
+    'users-detail',
+    'tags-list',
+    'tags-detail',
+    'ingredients-list',
+    'ingredients-search',
+    'ingredients-detail',
+    'recipes-list',
+    'recipes-list-cursor',
+    'recipes-list-compact',
+    'recipes-search',
+    'recipes-popular',
+    'recipes-trending',
+    'recipes-detail',
+)
+
+
+class Command(BaseCommand):
+    """
+    Замер числа запросов к БД, времени ответа и размера ответа
+    для всех маршрутов api/urls.py на синтетическом наборе данных.
+
+    Данные создаются в тестовой базе данных (SQLite или PostgreSQL,
+    в зависимости от настроек DATABASES), рабочая база не затрагивается.
+    Команда завершается с ошибкой, если число запросов маршрута
+    зависит от размера страницы или превышает сохраненный бюджет.
+    """
+    help = 'API benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=30)
+        parser.add_argument('--recipes', type=int, default=60)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=10)
+        parser.add_argument('--favorites', type=int, default=10,
+                            help='Favorite recipes per user')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Recipes in the shopping cart per user')
+        parser.add_argument('--subscriptions', type=int, default=5,
+                            help='Subscriptions per user')
+        parser.add_argument('--page-sizes', default='1,6,24',
+                            help='Page sizes for paginated routes')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--budget', default=BUDGET_FILE)
+        parser.add_argument('--update-budget', action='store_true',
+                            help='Store measured query counts as budget')
+        parser.add_argument('--output',
+                            help='Write measurements to a JSON file')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        page_sizes = [
+            int(size) for size in options['page_sizes'].split(',')
+        ]
+        if options['recipes'] < max(page_sizes):
+            raise CommandError('--recipes must not be less than page size')
+        random.seed(options['seed'])
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                self.seed(options)
+                results = self.run_scenarios(options, page_sizes)
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        if options['update_budget']:
+            budget = {
+                name: result['queries'] for name, result in results.items()
+            }
+            with open(options['budget'], 'w') as file:
+                json.dump(budget, file, indent=2, sort_keys=True)
+                file.write('\n')
+            return
+        errors = self.check_results(results, options['budget'])
+        if errors:
+            raise CommandError('\n'.join(errors))
+
+    def seed(self, options):
+        """
+        Создание синтетического набора данных.
+        """
+        with open(os.path.join(settings.DATA_DIR, 'ingredients.csv')) as file:
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in csv.reader(file)
+            )
+        with open(os.path.join(settings.DATA_DIR, 'tags.json')) as file:
+            Tag.objects.bulk_create(Tag(**tag) for tag in json.load(file))
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            User(
+                username='user{}'.format(number),
+                email='user{}@foodgram.local'.format(number),
+                first_name='Имя',
+                last_name='Фамилия',
+                password=password,
+            )
+            for number in range(options['users'])
+        )
+        users = list(User.objects.all())
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        tags = list(Tag.objects.all())
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=random.choice(users),
+                name='Рецепт {}'.format(number),
+                image='recipes/benchmark.gif',
+                description='Описание рецепта {}'.format(number),
+                cooking_time=random.randint(1, 120),
+            )
+            for number in range(options['recipes'])
+        )
+        recipes = list(Recipe.objects.all())
+        RecipesIngredient.objects.bulk_create(
+            RecipesIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient,
+                amount=random.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient in random.sample(
+                ingredients, options['ingredients_per_recipe']
+            )
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes
+            for tag in random.sample(tags, random.randint(1, len(tags)))
+        )
+        for model, count in ((Favorite, options['favorites']),
+                             (Cart, options['cart'])):
+            model.objects.bulk_create(
+                model(user=user, recipe=recipe)
+                for user in users
+                for recipe in random.sample(recipes, min(count, len(recipes)))
+            )
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=author)
+            for user in users
+            for author in random.sample(
+                [author for author in users if author != user],
+                min(options['subscriptions'], len(users) - 1)
+            )
+        )
+        with open(os.devnull, 'w') as devnull:
+            call_command('counters', stdout=devnull)
+            call_command('search_index', stdout=devnull)
+            call_command('feed', stdout=devnull)
+            call_command('rankings', stdout=devnull)
+
+    def get_scenarios(self):
+        """
+        Маршруты api/urls.py: (название, метод, адрес, данные, пагинация).
+
+        Возвращает пользователя, от имени которого выполняются запросы,
+        маршруты для этого пользователя и маршруты для анонимного
+        пользователя: варианты ANONYMOUS_SCENARIOS (общий кэшированный
+        ответ без наложения состояния) и маршруты авторизации.
+        """
+        user = User.objects.order_by('id').first()
+        author = Subscription.objects.filter(user=user).first().author
+        stranger = User.objects.exclude(
+            recipe_author__user=user
+        ).exclude(id=user.id).first()
+        recipe = Recipe.objects.filter(author=user).first()
+        if recipe is None:
+            recipe = Recipe.objects.first()
+            recipe.author = user
+            recipe.save()
+        other = Recipe.objects.exclude(
+            favorite_recipe__user=user
+        ).exclude(cart_recipe__user=user).first()
+        favorite = Favorite.objects.filter(user=user).first().recipe
+        cart = Cart.objects.filter(user=user).first().recipe
+        others = list(Recipe.objects.exclude(
+            favorite_recipe__user=user
+        ).values_list('id', flat=True)[:5])
+        carts = list(Cart.objects.filter(user=user).values_list(
+            'recipe_id', flat=True
+        ))
+        ingredient = Ingredient.objects.first()
+        on_hand = ','.join(str(pk) for pk in RecipesIngredient.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', flat=True)[:5])
+        tag = Tag.objects.first()
+        recipe_data = {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.id],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in Ingredient.objects.values_list(
+                    'id', flat=True
+                )[:10]
+            ],
+        }
+        scenarios = [
+            ('users-list', 'get', '/api/users/', None, False),
+            ('users-detail', 'get', f'/api/users/{author.id}/', None, False),
+            ('users-me', 'get', '/api/users/me/', None, False),
+            ('tags-list', 'get', '/api/tags/', None, False),
+            ('tags-detail', 'get', f'/api/tags/{tag.id}/', None, False),
+            ('ingredients-list', 'get', '/api/ingredients/', None, False),
+            ('ingredients-search', 'get', '/api/ingredients/?name=сах',
+             None, False),
+            ('ingredients-detail', 'get',
+             f'/api/ingredients/{ingredient.id}/', None, False),
+            ('recipes-list', 'get', '/api/recipes/', None, True),
+            ('recipes-list-filtered', 'get',
+             f'/api/recipes/?tags={tag.slug}&is_favorited=1', None, True),
+            ('recipes-list-cart', 'get',
+             '/api/recipes/?is_in_shopping_cart=1', None, True),
+            ('recipes-list-cursor', 'get', '/api/recipes/?cursor=',
+             None, True),
+            ('recipes-list-compact', 'get',
+             '/api/recipes/?fields=id,name,image,cooking_time', None, True),
+            ('recipes-search', 'get', '/api/recipes/?search=рецепт',
+             None, True),
+            ('recipes-what-to-cook', 'get',
+             f'/api/recipes/what_to_cook/?ingredients={on_hand}', None, True),
+            ('recipes-popular', 'get', '/api/recipes/?ordering=popular',
+             None, True),
+            ('recipes-trending', 'get', '/api/recipes/?ordering=trending',
+             None, True),
+            ('recipes-feed', 'get', '/api/recipes/feed/', None, True),
+            ('recipes-detail', 'get', f'/api/recipes/{recipe.id}/',
+             None, False),
+            ('recipes-create', 'post', '/api/recipes/', recipe_data, False),
+            ('recipes-update', 'patch', f'/api/recipes/{recipe.id}/',
+             recipe_data, False),
+            ('recipes-delete', 'delete', f'/api/recipes/{recipe.id}/',
+             None, False),
+            ('favorite-create', 'post',
+             f'/api/recipes/{other.id}/favorite/', None, False),
+            ('favorite-delete', 'delete',
+             f'/api/recipes/{favorite.id}/favorite/', None, False),
+            ('cart-create', 'post',
+             f'/api/recipes/{other.id}/shopping_cart/', None, False),
+            ('cart-delete', 'delete',
+             f'/api/recipes/{cart.id}/shopping_cart/', None, False),
+            ('favorite-bulk-create', 'post', '/api/recipes/favorite/',
+             {'recipes': others}, False),
+            ('cart-bulk-delete', 'delete', '/api/recipes/shopping_cart/',
+             {'recipes': carts}, False),
+            ('download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/', None, False),
+            ('subscriptions', 'get', '/api/users/subscriptions/', None, True),
+            ('subscriptions-cursor', 'get',
+             '/api/users/subscriptions/?cursor=', None, True),
+            ('subscribe-create', 'post',
+             f'/api/users/{stranger.id}/subscribe/', None, False),
+            ('subscribe-delete', 'delete',
+             f'/api/users/{author.id}/subscribe/', None, False),
+        ]
+        anonymous = [
+            (f'{name}-anonymous', method, url, data, paginated)
+            for name, method, url, data, paginated in scenarios
+            if name in ANONYMOUS_SCENARIOS
+        ] + [
+            ('users-create', 'post', '/api/users/', {
+                'username': 'newuser',
+                'email': 'newuser@foodgram.local',
+                'first_name': 'Имя',
+                'last_name': 'Фамилия',
+                'password': 'NewPassword-123',
+            }, False),
+            ('token-login', 'post', '/api/auth/token/login/',
+             {'email': user.email, 'password': PASSWORD}, False),
+        ]
+        return user, scenarios, anonymous
+
+    def measure(self, client, method, url, data):
+        """
+        Выполнение запроса с откатом всех изменений в базе данных.
+        """
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data, format='json')
+                if getattr(response, 'streaming', False):
+                    size = sum(len(chunk) for chunk in response)
+                else:
+                    size = len(response.content)
+                elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {url}: {response.status_code}'
+            )
+        return len(context.captured_queries), elapsed, size
+
+    def warm_up(self, user, user_state):
+        """
+        Очистка кэша перед замером: кэшированный ответ скрыл бы запросы
+        маршрута. Индексы в памяти процесса заполняются заново
+        до замера: это происходит один раз, а не при каждом запросе.
+        Кэш состояния пользователя заполняется, если user_state
+        установлен.
+        """
+        cache.clear()
+        ingredient_index.ensure_fresh()
+        recipe_ingredient_index.ensure_fresh()
+        tag_index.ensure_fresh()
+        if user_state:
+            get_user_state(user)
+
+    def run_scenarios(self, options, page_sizes):
+        """
+        Замер всех маршрутов. Первый повтор выполняется с незаполненным
+        кэшем состояния пользователя, остальные - с заполненным;
+        число запросов для размера страницы - максимум по всем повторам.
+        """
+        user, scenarios, anonymous = self.get_scenarios()
+        client = APIClient()
+        client.force_authenticate(user)
+        anonymous_client = APIClient()
+        results = {}
+        for client, (name, method, url, data, paginated) in [
+            (client, scenario) for scenario in scenarios
+        ] + [
+            (anonymous_client, scenario) for scenario in anonymous
+        ]:
+            sizes = page_sizes if paginated else [None]
+            queries = {}
+            times = []
+            payload = 0
+            for size in sizes:
+                target = url
+                if size is not None:
+                    separator = '&' if '?' in url else '?'
+                    target = f'{url}{separator}limit={size}'
+                counts = []
+                for repeat in range(options['repeat']):
+                    self.warm_up(user, user_state=repeat > 0)
+                    count, elapsed, payload = self.measure(
+                        client, method, target, data
+                    )
+                    counts.append(count)
+                    times.append(elapsed)
+                queries[size] = max(counts)
+            results[name] = {
+                'method': method.upper(),
+                'url': url,
+                'queries': max(queries.values()),
+                'scales_with_page_size': len(set(queries.values())) > 1,
+                'queries_by_page_size': {
+                    str(size): count for size, count in queries.items()
+                    if size is not None
+                },
+                'median_ms': round(statistics.median(times) * 1000, 2),
+                'payload_bytes': payload,
+            }
+        return results
+
+    def report(self, results):
+        self.stdout.write(
+            '{:<32}{:>8}{:>12}{:>12}'.format(
+                'route', 'queries', 'median ms', 'bytes'
+            )
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                '{:<32}{:>8}{:>12}{:>12}'.format(
+                    name,
+                    result['queries'],
+                    result['median_ms'],
+                    result['payload_bytes'],
+                )
+            )
+
+    def check_results(self, results, budget_file):
+        errors = []
+        budget = {}
+        if os.path.exists(budget_file):
+            with open(budget_file) as file:
+                budget = json.load(file)
+        for name, result in results.items():
+            if result['scales_with_page_size']:
+                errors.append(
+                    '{}: query count depends on page size {}'.format(
+                        name, result['queries_by_page_size']
+                    )
+                )
+            if name in budget and result['queries'] > budget[name]:
+                errors.append(
+                    '{}: {} queries, budget is {}'.format(
+                        name, result['queries'], budget[name]
+                    )
+                )
+        return errors
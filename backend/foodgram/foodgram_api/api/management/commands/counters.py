@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Cart, Favorite, Recipe
+from users.models import User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'cart_count', Cart, 'user'),
+)
+
+
+def actual_count(related_model, related_field):
+    """
+    Подзапрос: число объектов related_model, ссылающихся на объект
+    внешнего запроса через поле related_field.
+    """
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                count=Count('pk')
+            ).values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    """
+    Пересчет счетчиков (число добавлений рецепта в избранное,
+    число рецептов автора, размер корзины покупок пользователя).
+
+    Каждый счетчик пересчитывается одним запросом UPDATE.
+    """
+    help = 'Recalculate counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report counters that are out of date')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, field, related_model, related_field in COUNTERS:
+                count = actual_count(related_model, related_field)
+                stale = model.objects.annotate(
+                    actual=count
+                ).exclude(**{field: F('actual')}).count()
+                if not options['check']:
+                    model.objects.update(**{field: count})
+                self.stdout.write(
+                    f'{model.__name__}.{field}: {stale} out of date'
+                )
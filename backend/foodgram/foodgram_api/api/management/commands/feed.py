@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import rebuild_feeds
+
+
+class Command(BaseCommand):
+    """
+    Перестроение лент подписок всех пользователей
+    (после миграции или загрузки подписок и рецептов в обход API).
+    """
+    help = 'Rebuild subscription feeds'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_feeds()
+        self.stdout.write('Subscription feeds rebuilt')
@@ -1,26 +1,23 @@
-import json
+import os
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
 
+from api.importers import CatalogImporter, ImportCommand
+from api.indexes import ingredient_index
 from recipes.models import Ingredient
 
 
-class Command(BaseCommand):
+class Command(ImportCommand):
     """
-    Внесение ингредиентов из файла foodgram/data/ingredients.json
-    в базу данных.
+    Внесение ингредиентов из файла (по умолчанию
+    foodgram/data/ingredients.json) в базу данных.
+    Уже существующие ингредиенты пропускаются.
     """
     help = 'Ingredients'
+    importer = CatalogImporter(Ingredient, ('name', 'measurement_unit'))
+    default_path = os.path.join(settings.DATA_DIR, 'ingredients.json')
+    cache_scopes = ('ingredients',)
 
     def handle(self, *args, **options):
-        file = open('../data/ingredients.json')
-        data = json.load(file)
-        for elem in data:
-            Ingredient.objects.create(
-                name=elem['name'],
-                measurement_unit=elem[
-                    'measurement_unit'
-                ]
-            )
-        file.close()
-
+        super().handle(*args, **options)
+        ingredient_index.invalidate()
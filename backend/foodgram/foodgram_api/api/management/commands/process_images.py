@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import MAX_ATTEMPTS, claim_image_tasks, run_image_task
+from recipes.models import ImageTask, Recipe
+
+
+class Command(BaseCommand):
+    """
+    Обработчик очереди изображений рецептов.
+
+    Берет готовые задания пачками по --batch и ждет --sleep секунд,
+    когда очередь пуста. Можно запускать несколько обработчиков
+    одновременно: задания распределяются между ними через SKIP LOCKED.
+    """
+    help = 'Process queued recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=10,
+                            help='Number of tasks claimed at once')
+        parser.add_argument('--sleep', type=float, default=5,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty')
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help='Queue recipes whose images were never '
+                                 'processed')
+        parser.add_argument('--status', action='store_true',
+                            help='Only report the queue state')
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            self.enqueue_missing()
+        if options['status']:
+            self.report()
+            return
+        while True:
+            tasks = claim_image_tasks(options['batch'])
+            for task in tasks:
+                done = run_image_task(task)
+                self.stdout.write('{} {}'.format(
+                    task.recipe_id, 'done' if done else 'failed'
+                ))
+            if not tasks:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+
+    def enqueue_missing(self):
+        recipes = Recipe.objects.filter(
+            image_width__isnull=True, image_task__isnull=True
+        ).exclude(image='').values_list('id', flat=True)
+        tasks = ImageTask.objects.bulk_create(
+            ImageTask(recipe_id=recipe_id) for recipe_id in recipes
+        )
+        self.stdout.write(f'{len(tasks)} queued')
+
+    def report(self):
+        tasks = ImageTask.objects.all()
+        failed = tasks.filter(attempts__gte=MAX_ATTEMPTS)
+        self.stdout.write('pending: {}, waiting: {}, failed: {}'.format(
+            tasks.filter(
+                run_at__lte=timezone.now(), attempts__lt=MAX_ATTEMPTS
+            ).count(),
+            tasks.filter(
+                run_at__gt=timezone.now(), attempts__lt=MAX_ATTEMPTS
+            ).count(),
+            failed.count(),
+        ))
+        for task in failed.select_related('recipe'):
+            self.stdout.write(f'{task.recipe_id} {task.recipe}: {task.error}')
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.cache import invalidate_generations
+from recipes.rankings import compute_rankings
+
+
+class Command(BaseCommand):
+    """
+    Пересчет оценок популярности рецептов (?ordering=popular|trending).
+
+    Запускается по расписанию (cron) или с --interval: тогда оценки
+    пересчитываются каждые --interval секунд.
+    """
+    help = 'Recalculate recipe popularity rankings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Repeat every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            count = compute_rankings()
+            invalidate_generations(['rankings'])
+            self.stdout.write(f'{count} recipes ranked')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
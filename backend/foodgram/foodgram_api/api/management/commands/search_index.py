@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.search import update_search_index
+
+
+class Command(BaseCommand):
+    """
+    Перестроение поискового индекса всех рецептов
+    (после миграции или загрузки рецептов в обход API).
+    """
+    help = 'Rebuild recipe search index'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            update_search_index()
+        self.stdout.write('Recipe search index rebuilt')
@@ -1,25 +1,22 @@
-import json
+import os
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
 
+from api.importers import CatalogImporter, ImportCommand
+from api.indexes import tag_index
 from recipes.models import Tag
 
 
-class Command(BaseCommand):
+class Command(ImportCommand):
     """
-    Внесение ингредиентов из файла foodgram/data/tags.json
-    в базу данных.
+    Внесение тэгов из файла (по умолчанию foodgram/data/tags.json)
+    в базу данных. Тэги с уже существующим slug пропускаются.
     """
     help = 'Tags'
+    importer = CatalogImporter(Tag, ('name', 'color', 'slug'))
+    default_path = os.path.join(settings.DATA_DIR, 'tags.json')
+    cache_scopes = ('tags',)
 
     def handle(self, *args, **options):
-        file = open('../data/tags.json')
-        data = json.load(file)
-        for elem in data:
-            Tag.objects.create(
-                name=elem['name'],
-                color=elem['color'],
-                slug=elem['slug'],
-            )
-        file.close()
-
+        super().handle(*args, **options)
+        tag_index.invalidate()
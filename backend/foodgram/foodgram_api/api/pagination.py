@@ -1,6 +1,175 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """
+    Оценка числа строк запроса планировщиком PostgreSQL (без выполнения
+    запроса). Для остальных СУБД выполняется обычный COUNT(*).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
 
 
 class PageLimitPagination(PageNumberPagination):
+    """
+    Постраничный вывод (?page=, ?limit=).
+
+    С параметром ?cursor= (в том числе пустым) включается
+    курсорный режим: страница выбирается условием по ключу ordering
+    вместо OFFSET, общее число объектов не считается. Ссылки next и
+    previous содержат курсор соседней страницы, поэтому новые объекты,
+    добавленные во время просмотра, не сдвигают страницы.
+    Число объектов добавляется в ответ по запросу ?count=exact
+    или ?count=approximate (оценка планировщика PostgreSQL).
+
+    Ключ курсора - поля, однозначно упорядочивающие объекты;
+    переопределяется атрибутом cursor_ordering представления
+    или его методом get_cursor_ordering() (None - ключ по умолчанию).
+    """
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-pub_time', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.model = queryset.model
+        self.count = self.get_count(queryset, request)
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(
+            request.query_params[self.cursor_query_param]
+        )
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.reverse_field(field) for field in ordering]
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(
+                ordering, position
+            ))
+        page = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page_objects = page
+        return page
+
+    def get_ordering(self, view):
+        get_cursor_ordering = getattr(view, 'get_cursor_ordering', None)
+        ordering = get_cursor_ordering() if get_cursor_ordering else None
+        return ordering or getattr(view, 'cursor_ordering', self.ordering)
+
+    def get_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param)
+        if count == 'exact':
+            return queryset.count()
+        if count == 'approximate':
+            return estimate_count(queryset)
+        return None
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def get_keyset_filter(self, ordering, position):
+        """
+        Условие "объект следует за position" для ключа ordering:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = {
+                previous: position[previous]
+                for previous in self.fields[:index]
+            }
+            condition[f'{name}__{lookup}'] = position[name]
+            conditions.append(Q(**condition))
+        return reduce(or_, conditions)
+
+    def encode_cursor(self, instance, reverse):
+        values = [
+            self.model._meta.get_field(name).value_to_string(instance)
+            for name in self.fields
+        ]
+        token = json.dumps([values, reverse]).encode()
+        return urlsafe_b64encode(token).decode()
+
+    def decode_cursor(self, token):
+        if not token:
+            return None, False
+        try:
+            values, reverse = json.loads(urlsafe_b64decode(token.encode()))
+            position = {
+                name: self.model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.fields, values)
+            }
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound('Invalid cursor')
+        if len(position) != len(self.fields):
+            raise NotFound('Invalid cursor')
+        return position, bool(reverse)
+
+    def get_cursor_link(self, instance, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(instance, reverse)
+        )
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.page_objects:
+            return None
+        return self.get_cursor_link(self.page_objects[-1], False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.page_objects:
+            url = self.request.build_absolute_uri()
+            return replace_query_param(url, self.cursor_query_param, '')
+        return self.get_cursor_link(self.page_objects[0], True)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
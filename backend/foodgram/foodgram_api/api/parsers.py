@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             TemporaryFileUploadHandler)
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+
+from .fields import IMAGE_TOO_LARGE
+
+
+class RecipeImageUploadHandler(FileUploadHandler):
+    """
+    Ограничение размера файла в запросе multipart/form-data
+    (RECIPE_IMAGE_MAX_SIZE байт).
+
+    Запрос, длина которого заведомо больше допустимой, отклоняется
+    до чтения тела; размер файла проверяется по мере получения частей,
+    поэтому слишком большой файл не дочитывается.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        limit = (
+            settings.RECIPE_IMAGE_MAX_SIZE
+            + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0)
+        )
+        if content_length > limit:
+            self.reject()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.reject()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    @staticmethod
+    def reject():
+        raise ValidationError({
+            'image': [IMAGE_TOO_LARGE.format(settings.RECIPE_IMAGE_MAX_SIZE)]
+        })
+
+
+class RecipeMultiPartParser(MultiPartParser):
+    """
+    Разбор multipart/form-data для рецептов: файлы частями
+    записываются во временный файл на диске, а не в память.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request.upload_handlers = [
+            RecipeImageUploadHandler(request),
+            TemporaryFileUploadHandler(request),
+        ]
+        return super().parse(stream, media_type, parser_context)
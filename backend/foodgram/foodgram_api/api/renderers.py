@@ -0,0 +1,139 @@
+import csv
+import json
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+SHOPPING_CART_TITLE = 'Для приготовления выбранных рецептов Вам понадобится:'
+
+
+def get_message(data):
+    """
+    Текст сообщения для ответов, не содержащих список покупок.
+    """
+    if isinstance(data, dict) and 'detail' in data:
+        return str(data['detail'])
+    return str(data)
+
+
+class EchoBuffer:
+    """
+    Буфер для csv.writer, возвращающий записанную строку.
+    """
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartTextRenderer(BaseRenderer):
+    """
+    Список покупок в виде текстового файла.
+
+    Метод stream формирует файл по частям из строк
+    (название, единица измерения, количество).
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return get_message(data).encode(self.charset)
+
+    def stream(self, rows):
+        yield SHOPPING_CART_TITLE + '\n\n'
+        for name, measurement_unit, amount in rows:
+            yield f'{name} - {amount} {measurement_unit}.\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartTextRenderer):
+    """
+    Список покупок в формате CSV.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(['name', 'measurement_unit', 'amount'])
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class ShoppingCartJSONRenderer(JSONRenderer):
+    """
+    Список покупок в формате JSON.
+    """
+
+    def stream(self, rows):
+        separator = '['
+        for name, measurement_unit, amount in rows:
+            yield separator + json.dumps(
+                {
+                    'name': name,
+                    'measurement_unit': measurement_unit,
+                    'amount': amount,
+                },
+                ensure_ascii=False
+            )
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+
+class ShoppingCartPDFRenderer(BaseRenderer):
+    """
+    Список покупок в формате PDF.
+
+    Документ собирается во временном файле, который хранится в памяти
+    только до SPOOL_SIZE байт, и отдается частями по CHUNK_SIZE байт.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+
+    SPOOL_SIZE = 1024 * 1024
+    CHUNK_SIZE = 64 * 1024
+    FONT_NAME = 'ShoppingCartFont'
+    FONT_SIZE = 12
+    MARGIN = 50
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(self.write([get_message(data)]))
+
+    def stream(self, rows):
+        lines = (
+            f'{name} - {amount} {measurement_unit}.'
+            for name, measurement_unit, amount in rows
+        )
+        yield from self.write([SHOPPING_CART_TITLE, ''], lines)
+
+    def write(self, *line_groups):
+        if self.FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.FONT_NAME, settings.SHOPPING_CART_PDF_FONT)
+            )
+        _, height = A4
+        step = self.FONT_SIZE * 1.5
+        with SpooledTemporaryFile(max_size=self.SPOOL_SIZE) as file:
+            canvas = Canvas(file, pagesize=A4)
+            canvas.setFont(self.FONT_NAME, self.FONT_SIZE)
+            position = height - self.MARGIN
+            for lines in line_groups:
+                for line in lines:
+                    if position < self.MARGIN:
+                        canvas.showPage()
+                        canvas.setFont(self.FONT_NAME, self.FONT_SIZE)
+                        position = height - self.MARGIN
+                    canvas.drawString(self.MARGIN, position, line)
+                    position -= step
+            canvas.save()
+            file.seek(0)
+            chunk = file.read(self.CHUNK_SIZE)
+            while chunk:
+                yield chunk
+                chunk = file.read(self.CHUNK_SIZE)
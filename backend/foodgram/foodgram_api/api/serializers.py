@@ -1,15 +1,120 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from rest_framework.validators import UniqueValidator
 from djoser.serializers import UserCreateSerializer
-from drf_extra_fields.fields import Base64ImageField
 
-from .fields import ImageFieldForRecipeRead
-from .utils import add_ingredients_tags, get_user_and_recipe_from_serializer
+
+from .cache import invalidate_shopping_cart
+from .fields import (ImageFieldForRecipeRead, RecipeImageField,
+                     RecipeImageSrcsetField, RecipeImageThumbField)
+from .utils import add_ingredients_tags, check_objects_exist
 from recipes.models import (Cart, Favorite, Ingredient, Recipe,
                             RecipesIngredient, Tag)
+from recipes.images import delete_image_files_on_commit, enqueue_recipe_image
+from recipes.search import update_search_index
 from users.models import Subscription, User
 
 
+class UniqueCreateMixin:
+    """
+    Создание объекта с проверкой уникальности на уровне БД:
+    нарушение ограничения уникальности возвращается как ошибка валидации
+    ERROR_ALREADY_EXISTS без предварительного запроса exists().
+    """
+    ERROR_ALREADY_EXISTS = None
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [self.ERROR_ALREADY_EXISTS]
+            })
+
+
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа параметрами запроса.
+
+    С ?fields=id,name,... выводятся только перечисленные поля, причем
+    вложенные объекты (expandable_fields) выводятся в компактном виде
+    (get_compact_fields), если их нет в ?expand=. Поля из ?expand=
+    выводятся полностью. Без ?fields= выводятся все поля.
+    Выбор применяется только к сериализатору верхнего уровня.
+
+    В общий ответ (shared_response в контексте) всегда добавляются
+    поля overlay_fields, нужные для наложения на него состояния
+    пользователя; невыбранные из них удаляет представление.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    expandable_fields = ()
+    overlay_fields = ()
+
+    @classmethod
+    def get_query_list(cls, request, name):
+        return {
+            value for value in request.query_params.get(name, '').split(',')
+            if value
+        }
+
+    @classmethod
+    def get_selection(cls, request):
+        """
+        Выбранные в запросе request поля и поля с полным выводом
+        вложенных объектов: (fields, expand) или None, если поля
+        не выбраны.
+        """
+        fields = cls.get_query_list(request, cls.fields_query_param)
+        if not fields:
+            return None
+        expand = cls.get_query_list(request, cls.expand_query_param)
+        errors = {}
+        unknown = fields - set(cls.Meta.fields)
+        if unknown:
+            errors[cls.fields_query_param] = [
+                'Unknown fields: {}'.format(', '.join(sorted(unknown)))
+            ]
+        unknown = expand - set(cls.expandable_fields)
+        if unknown:
+            errors[cls.expand_query_param] = [
+                'Fields cannot be expanded: {}'.format(
+                    ', '.join(sorted(unknown))
+                )
+            ]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return fields | expand, expand
+
+    def get_compact_fields(self):
+        return {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        request = self.context.get('request')
+        if parent is not None or request is None:
+            return fields
+        selection = self.get_selection(request)
+        if selection is None:
+            return fields
+        selected, expand = selection
+        if self.context.get('shared_response'):
+            selected = selected | set(self.overlay_fields)
+        compact = {
+            name: field for name, field in self.get_compact_fields().items()
+            if name not in expand
+        }
+        return {
+            name: compact.get(name, field)
+            for name, field in fields.items() if name in selected
+        }
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     """
     Сериализатор для создания пользователей.
@@ -42,7 +147,7 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         model = User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для пользователей. Чтение.
     """
@@ -60,6 +165,8 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
         return (
             user.is_authenticated
@@ -87,9 +194,7 @@ class RecipesIngredientsSerializer(serializers.ModelSerializer):
     """
     Подготовка ингредиентов для рецептов. Создание/изменение.
     """
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipesIngredient
@@ -123,10 +228,32 @@ class RecipeIngredientsSerializerRead(serializers.ModelSerializer):
         ]
 
 
-class RecipesSerializerRead(serializers.ModelSerializer):
+class RecipeIngredientsSerializerCompact(serializers.ModelSerializer):
+    """
+    Подготовка ингредиентов для рецептов. Чтение в компактном виде.
+    """
+    id = serializers.ReadOnlyField(
+        source='ingredient_id'
+    )
+
+    class Meta:
+        model = RecipesIngredient
+        fields = [
+            'id',
+            'amount',
+        ]
+
+
+class RecipesSerializerRead(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для рецептов. Чтение.
+
+    В компактном виде автор и тэги выводятся как id,
+    ингредиенты - как id и количество.
     """
+    expandable_fields = ('author', 'tags', 'ingredients')
+    overlay_fields = ('id',)
+
     author = UserSerializer(
         read_only=True
     )
@@ -140,6 +267,8 @@ class RecipesSerializerRead(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = ImageFieldForRecipeRead()
+    image_thumb = RecipeImageThumbField()
+    srcset = RecipeImageSrcsetField()
     text = serializers.CharField(
         source='description'
     )
@@ -157,9 +286,27 @@ class RecipesSerializerRead(serializers.ModelSerializer):
             'is_favorited',
             'is_in_shopping_cart',
             'image',
+            'image_thumb',
+            'srcset',
+            'image_status',
         ]
 
+    def get_compact_fields(self):
+        return {
+            'author': serializers.PrimaryKeyRelatedField(read_only=True),
+            'tags': serializers.PrimaryKeyRelatedField(
+                many=True,
+                read_only=True
+            ),
+            'ingredients': RecipeIngredientsSerializerCompact(
+                source='recipesingredient_set',
+                many=True
+            ),
+        }
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return 1 if obj.is_favorited else 0
         user = self.context['request'].user
         return (
             1 if user.is_authenticated
@@ -169,6 +316,8 @@ class RecipesSerializerRead(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return 1 if obj.is_in_shopping_cart else 0
         user = self.context['request'].user
         return (
             1 if user.is_authenticated
@@ -178,15 +327,61 @@ class RecipesSerializerRead(serializers.ModelSerializer):
             ).exists() else 0
         )
 
+    @staticmethod
+    def apply_user_state(recipe, state):
+        """
+        Наложение состояния пользователя state (api.cache.UserState)
+        на рецепт recipe, сериализованный для анонимного пользователя.
+        Поля, не выбранные в запросе (?fields=), не добавляются.
+        """
+        if 'is_favorited' in recipe:
+            recipe['is_favorited'] = (
+                1 if recipe['id'] in state.favorites else 0
+            )
+        if 'is_in_shopping_cart' in recipe:
+            recipe['is_in_shopping_cart'] = (
+                1 if recipe['id'] in state.cart else 0
+            )
+        author = recipe.get('author')
+        if isinstance(author, dict) and 'is_subscribed' in author:
+            author['is_subscribed'] = author['id'] in state.subscriptions
+        return recipe
+
+
+class RecipeMatchSerializer(RecipesSerializerRead):
+    """
+    Рецепт, подобранный по имеющимся ингредиентам: доля имеющихся
+    ингредиентов и список недостающих.
+    """
+    coverage = serializers.SerializerMethodField()
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(RecipesSerializerRead.Meta):
+        fields = RecipesSerializerRead.Meta.fields + [
+            'coverage',
+            'missing_ingredients',
+        ]
+
+    def get_coverage(self, obj):
+        return round(obj.coverage, 2)
+
+    def get_missing_ingredients(self, obj):
+        return RecipeIngredientsSerializerRead(
+            [
+                item for item in obj.recipesingredient_set.all()
+                if item.ingredient_id in obj.missing_ingredients
+            ],
+            many=True
+        ).data
+
 
 class RecipesSerializer(serializers.ModelSerializer):
     """
     Сериализатор для рецептов. Создание/изменение.
     """
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
         required=True,
-        many=True,
     )
     ingredients = RecipesIngredientsSerializer(
         many=True,
@@ -195,7 +390,7 @@ class RecipesSerializer(serializers.ModelSerializer):
     text = serializers.CharField(
         source='description'
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -210,6 +405,7 @@ class RecipesSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ('author', )
 
+    @transaction.atomic
     def create(self, validated_data):
         recipe = Recipe.objects.create(
             author=validated_data['author'],
@@ -218,26 +414,42 @@ class RecipesSerializer(serializers.ModelSerializer):
             cooking_time=validated_data['cooking_time'],
             image=validated_data['image']
         )
-        return add_ingredients_tags(
+        recipe = add_ingredients_tags(
             recipe,
             validated_data,
             RecipesIngredient
         )[0]
+        update_search_index([recipe.id])
+        enqueue_recipe_image(recipe, created=True)
+        return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        RecipesIngredient.objects.filter(recipe=instance.id).delete()
+        if 'ingredients' in validated_data:
+            invalidate_shopping_cart(
+                list(instance.cart_recipe.values_list('user_id', flat=True))
+            )
         instance, validated_data = add_ingredients_tags(
             instance,
             validated_data,
             RecipesIngredient
         )
+        if 'image' in validated_data:
+            delete_image_files_on_commit(
+                instance.image.name, instance.image_width
+            )
+            validated_data['image_width'] = None
+            validated_data['image_status'] = Recipe.IMAGE_PENDING
         super().update(instance, validated_data)
+        update_search_index([instance.id])
+        if 'image' in validated_data:
+            enqueue_recipe_image(instance)
         return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = Recipe.objects.for_read(request.user).get(pk=instance.pk)
         return RecipesSerializerRead(
             instance, context=context
         ).data
@@ -261,6 +473,11 @@ class RecipesSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError(
                     'amount must be positive'
                 )
+        check_objects_exist(Ingredient, ingredients)
+        return value
+
+    def validate_tags(self, value):
+        check_objects_exist(Tag, value)
         return value
 
 
@@ -268,6 +485,8 @@ class RecipesForSubscribeSerializer(serializers.ModelSerializer):
     """
     Подготовка рецептов для подписок пользователя.
     """
+    image_thumb = RecipeImageThumbField()
+    srcset = RecipeImageSrcsetField()
 
     class Meta:
         model = Recipe
@@ -275,10 +494,31 @@ class RecipesForSubscribeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumb',
+            'srcset',
             'cooking_time',
         ]
 
 
+class SubscriptionsListSerializer(serializers.ListSerializer):
+    """
+    Список подписок: последние рецепты всех авторов страницы
+    загружаются одним запросом.
+    """
+
+    def to_representation(self, data):
+        subscriptions = list(data)
+        recipes = Recipe.objects.latest_by_author(
+            {subscription.author_id for subscription in subscriptions},
+            self.child.get_recipes_limit()
+        )
+        for subscription in subscriptions:
+            subscription.author.latest_recipes = recipes[
+                subscription.author_id
+            ]
+        return super().to_representation(subscriptions)
+
+
 class SubscriptionsSerializer(serializers.ModelSerializer):
     """
     Просмотр подписок пользователя.
@@ -310,29 +550,35 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
             'recipes',
             'recipes_count',
         ]
+        list_serializer_class = SubscriptionsListSerializer
 
     def get_is_subscribed(self, obj):
         return 1
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        return obj.author.recipes_count
+
+    def get_recipes_limit(self):
+        limit = self.context.get('request').GET.get('recipes_limit')
+        if limit is None:
+            return None
+        try:
+            return max(int(limit), 0)
+        except ValueError:
+            raise serializers.ValidationError(
+                {'recipes_limit': 'A valid integer is required.'}
+            )
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        user = request.user
-        limit = request.GET.get('recipes_limit')
-        if limit is not None:
-            queryset = Recipe.objects.filter(
-                author__recipe_author__user=user
-            )[:int(limit)]
-        else:
-            queryset = Recipe.objects.filter(
-                author__recipe_author__user=user
-            )
-        return RecipesForSubscribeSerializer(queryset, many=True).data
+        recipes = getattr(obj.author, 'latest_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.latest_by_author(
+                [obj.author_id], self.get_recipes_limit()
+            )[obj.author_id]
+        return RecipesForSubscribeSerializer(recipes, many=True).data
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(UniqueCreateMixin, serializers.ModelSerializer):
     """
     Подписки. Создание/удаление.
     """
@@ -343,6 +589,8 @@ class SubscribeSerializer(serializers.ModelSerializer):
         fields = ['username']
         read_only_fields = ['author', 'user']
 
+    ERROR_ALREADY_EXISTS = 'You have already subscribed to the author'
+
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
@@ -358,17 +606,10 @@ class SubscribeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 detail='Subscribe to yourself not allowed'
             )
-        if Subscription.objects.filter(
-            author=author_id,
-            user=user_id
-        ).exists():
-            raise serializers.ValidationError(
-                detail='You have already subscribed to the author'
-            )
         return data
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(UniqueCreateMixin, serializers.ModelSerializer):
     """
     Обработка корзины покупок пользователя.
     """
@@ -380,16 +621,10 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['id', 'name', 'cooking_time']
 
-    def validate(self, data):
-        recipe_id, user_id = get_user_and_recipe_from_serializer(self)
-        if Cart.objects.filter(recipe=recipe_id, user=user_id).exists():
-            raise serializers.ValidationError(
-                detail='The recipe is already in the cart'
-            )
-        return data
+    ERROR_ALREADY_EXISTS = 'The recipe is already in the cart'
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(UniqueCreateMixin, serializers.ModelSerializer):
     """
     Обработка списка избранных рецептов пользователя.
     """
@@ -401,10 +636,16 @@ class FavoriteSerializer(serializers.ModelSerializer):
         model = Favorite
         fields = ['id', 'name', 'cooking_time']
 
-    def validate(self, data):
-        recipe_id, user_id = get_user_and_recipe_from_serializer(self)
-        if Favorite.objects.filter(recipe=recipe_id, user=user_id).exists():
-            raise serializers.ValidationError(
-                detail='The recipe is already in the favorite list'
-            )
-        return data
+    ERROR_ALREADY_EXISTS = 'The recipe is already in the favorite list'
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """
+    Список id рецептов для добавления/удаления нескольких рецептов
+    в корзину покупок или избранное одним запросом.
+    """
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
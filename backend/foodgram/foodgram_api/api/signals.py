@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_generations, invalidate_shopping_cart
+from .indexes import ingredient_index, recipe_ingredient_index, tag_index
+from .utils import update_counter
+from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from users.models import User
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def update_recipe_ingredient_index(instance, **kwargs):
+    recipe_ingredient_index.update([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    tag_index.invalidate()
+    invalidate_generations(['tags'])
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    invalidate_generations(['ingredients'])
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipes(**kwargs):
+    invalidate_generations(['recipes'])
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_recipe_authors(update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        invalidate_generations(['recipes'])
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_counter(User, [instance.author_id], 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    update_counter(User, [instance.author_id], 'recipes_count', -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def decrement_cart_counts(instance, **kwargs):
+    """
+    Рецепт удаляется из корзин покупок каскадно, без сигналов
+    для строк корзины: размер корзины этих пользователей
+    уменьшается до удаления.
+    """
+    user_ids = list(
+        Cart.objects.filter(recipe=instance).values_list('user_id', flat=True)
+    )
+    update_counter(User, user_ids, 'cart_count', -1)
+    invalidate_shopping_cart(user_ids)
+
+
+@receiver(pre_delete, sender=User)
+def decrement_favorites_counts(instance, **kwargs):
+    """
+    Избранное пользователя удаляется каскадно: число добавлений
+    в избранное этих рецептов уменьшается до удаления.
+    """
+    update_counter(
+        Recipe,
+        list(
+            Favorite.objects.filter(user=instance).values_list(
+                'recipe_id', flat=True
+            )
+        ),
+        'favorites_count',
+        -1
+    )
+
+
+@receiver(request_started)
+def check_database_connections(**kwargs):
+    """
+    Проверка постоянных соединений с БД (CONN_MAX_AGE) перед запросом:
+    соединение, разорванное сервером БД, закрывается и будет открыто
+    заново, вместо ошибки при первом запросе к БД.
+    """
+    if not settings.DB_CONN_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+
+from recipes.models import Cart, Favorite, Recipe
+from users.models import Subscription, User
+
+
+class RecipeFieldsUserStateTests(APITestCase):
+    """
+    Состояние пользователя в общем ответе о рецептах при выборе
+    полей ?fields= без id.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='a', last_name='a', password='password'
+        )
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com',
+            first_name='u', last_name='u', password='password'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='recipe', description='text',
+            cooking_time=5, image='recipes/recipe.jpg'
+        )
+        Favorite.objects.create(user=cls.user, recipe=cls.recipe)
+        Cart.objects.create(user=cls.user, recipe=cls.recipe)
+        Subscription.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, user=None):
+        self.client.force_authenticate(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_flags(self):
+        for _ in range(2):
+            data = self.get(
+                '/api/recipes/?fields=name,is_favorited,is_in_shopping_cart',
+                self.user
+            )
+            self.assertEqual(data['results'], [
+                {'name': 'recipe', 'is_favorited': 1,
+                 'is_in_shopping_cart': 1},
+            ])
+
+    def test_detail_flags(self):
+        data = self.get(
+            f'/api/recipes/{self.recipe.id}/?fields=name,is_favorited',
+            self.user
+        )
+        self.assertEqual(data, {'name': 'recipe', 'is_favorited': 1})
+
+    def test_author_is_subscribed(self):
+        data = self.get(
+            '/api/recipes/?fields=name,author&expand=author', self.user
+        )
+        recipe = data['results'][0]
+        self.assertEqual(set(recipe), {'name', 'author'})
+        self.assertIs(recipe['author']['is_subscribed'], True)
+
+    def test_anonymous(self):
+        url = '/api/recipes/?fields=name,is_favorited'
+        self.get(url, self.user)
+        data = self.get(url)
+        self.assertEqual(data['results'], [
+            {'name': 'recipe', 'is_favorited': 0},
+        ])
+
+    def test_id_requested(self):
+        data = self.get('/api/recipes/?fields=id,is_favorited', self.user)
+        self.assertEqual(data['results'], [
+            {'id': self.recipe.id, 'is_favorited': 1},
+        ])
@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (CartViewSet, FavoriteViewSet, FoodgramUserViewSet,
-                    IngredientsViewSet, RecipesViewSet, SubscribeViewSet,
+from .views import (CartBulkView, CartViewSet, FavoriteBulkView,
+                    FavoriteViewSet, FoodgramUserViewSet, IngredientsViewSet,
+                    RecipesViewSet, SubscribeViewSet,
                     SubscriptionsListViewSet, TagsViewSet,
                     download_shopping_cart)
 
@@ -26,6 +27,16 @@ urlpatterns = [
         download_shopping_cart,
         name='download'
     ),
+    path(
+        'recipes/shopping_cart/',
+        CartBulkView.as_view(),
+        name='cart-bulk'
+    ),
+    path(
+        'recipes/favorite/',
+        FavoriteBulkView.as_view(),
+        name='favorite-bulk'
+    ),
     path(
         'users/subscriptions/',
         SubscriptionsListViewSet.as_view(),
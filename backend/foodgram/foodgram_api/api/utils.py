@@ -1,3 +1,10 @@
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from rest_framework.serializers import ValidationError
+
+from recipes.models import RecipesIngredient
+
+
 def add_ingredients_tags(obj, data, model):
     """
     Добавление ингедиентов и тэгов к рецепту.
@@ -5,26 +12,89 @@ def add_ingredients_tags(obj, data, model):
     obj - объект рецепта, в который необходимо добавить нгредиент/тэг,
     data - словарь, содежащий ключи 'ingredients' и 'tags',
     model - модель, связывающая рецепт и ингредиенты (RecipesIngredients)
+
+    Изменяются только отличающиеся записи: новые ингредиенты добавляются
+    одним bulk_create, изменившиеся количества сохраняются одним
+    bulk_update, лишние ингредиенты удаляются одним запросом.
+    Отсутствующие в data ключи оставляют состав рецепта без изменений.
     """
-    ingredients = data.pop('ingredients')
-    tags = data.pop('tags')
-    obj.tags.set(tags)
-    for ingredient in ingredients:
-        current_ingredient = ingredient['id']
-        current_ingredient_amount = ingredient['amount']
-        model.objects.create(
-            recipe=obj,
-            ingredient=current_ingredient,
-            amount=current_ingredient_amount
-        )
+    ingredients = data.pop('ingredients', None)
+    tags = data.pop('tags', None)
+    if tags is not None:
+        obj.tags.set(tags)
+    if ingredients is None:
+        return [obj, data]
+    amounts = {
+        ingredient['id']: ingredient['amount']
+        for ingredient in ingredients
+    }
+    current = {
+        row.ingredient_id: row for row in model.objects.filter(recipe=obj)
+    }
+    removed = [
+        row.id for ingredient_id, row in current.items()
+        if ingredient_id not in amounts
+    ]
+    changed = []
+    added = []
+    for ingredient_id, amount in amounts.items():
+        row = current.get(ingredient_id)
+        if row is None:
+            added.append(
+                model(recipe=obj, ingredient_id=ingredient_id, amount=amount)
+            )
+        elif row.amount != amount:
+            row.amount = amount
+            changed.append(row)
+    if removed:
+        model.objects.filter(id__in=removed).delete()
+    if changed:
+        model.objects.bulk_update(changed, ['amount'])
+    if added:
+        model.objects.bulk_create(added)
     return [obj, data]
 
 
-def get_user_and_recipe_from_serializer(serializer):
+def check_objects_exist(model, ids):
+    """
+    Проверка одним запросом, что все объекты model с id из ids существуют.
+    """
+    existing = set(
+        model.objects.filter(id__in=ids).values_list('id', flat=True)
+    )
+    for pk in ids:
+        if pk not in existing:
+            raise ValidationError(
+                f'Invalid pk "{pk}" - object does not exist.'
+            )
+
+
+def get_shopping_cart(user):
     """
-    Получение id рецепта и id пользователя из сериализатора.
+    Суммарное количество каждого ингредиента для рецептов в корзине
+    пользователя: строки (название, единица измерения, количество),
+    упорядоченные по названию. Агрегация выполняется одним запросом.
     """
-    context = serializer.context
-    recipe_id = int(context.get('view').kwargs['recipe_id'])
-    user_id = context.get('request').user.id
-    return [recipe_id, user_id]
+    return RecipesIngredient.objects.filter(
+        recipe__cart_recipe__user=user.id
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        total=Sum('amount')
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'total'
+    )
+
+
+def update_counter(model, pks, field, delta):
+    """
+    Изменение счетчика field объектов model с первичными ключами pks
+    на delta одним запросом UPDATE (без чтения текущего значения).
+    Счетчик не становится отрицательным.
+    """
+    if pks:
+        model.objects.filter(pk__in=pks).update(
+            **{field: Greatest(F(field) + delta, 0)}
+        )
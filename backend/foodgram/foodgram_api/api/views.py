@@ -1,24 +1,41 @@
-from django.db.models.aggregates import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from django_filters import rest_framework as filters
 from rest_framework import generics, status, viewsets
-from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.decorators import (action, api_view, permission_classes,
+                                       renderer_classes)
+from rest_framework.exceptions import MethodNotAllowed, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from djoser.permissions import CurrentUserOrAdmin
 from djoser.views import UserViewSet
 
-from .filters import IngredientsFilter, RecipeFilter
+from .cache import (ResponseCacheMixin, get_shopping_cart_snapshot,
+                    get_shopping_cart_version, invalidate_shopping_cart,
+                    invalidate_user_state)
+from .filters import RecipeFilter
+from .indexes import ingredient_index, recipe_ingredient_index
 from .pagination import PageLimitPagination
+from .parsers import RecipeMultiPartParser
 from .permissions import IsAdminOrReadOnly, IsAuthorOrAdminOrReadOnly
+from .renderers import (ShoppingCartCSVRenderer, ShoppingCartJSONRenderer,
+                        ShoppingCartPDFRenderer, ShoppingCartTextRenderer)
 from .serializers import (CartSerializer, FavoriteSerializer,
-                          IngredientsSerializer, RecipesSerializer,
+                          IngredientsSerializer, RecipeIdsSerializer,
+                          RecipeMatchSerializer, RecipesSerializer,
                           RecipesSerializerRead, SubscribeSerializer,
-                          SubscriptionsSerializer, TagsSerializer)
-from recipes.models import (Cart, Favorite, Ingredient, Recipe,
-                            RecipesIngredient, Tag)
+                          SubscriptionsSerializer, TagsSerializer,
+                          UserSerializer)
+from .utils import update_counter
+from recipes.feed import (add_author_to_feed, add_recipe_to_feeds,
+                          remove_author_from_feed)
+from recipes.models import Cart, Favorite, FeedItem, Ingredient, Recipe, Tag
 from users.models import Subscription, User
 
 
@@ -33,7 +50,22 @@ class CartFavoriteBaseViewSet(viewsets.ModelViewSet):
         user = self.request.user
         recipe_id = self.kwargs.get('recipe_id')
         recipe = get_object_or_404(Recipe, id=recipe_id)
-        serializer.save(recipe=recipe, user=user)
+        with transaction.atomic():
+            instance = serializer.save(recipe=recipe, user=user)
+            self.update_counters(instance, 1)
+        invalidate_user_state([user.id])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            self.update_counters(instance, -1)
+        invalidate_user_state([instance.user_id])
+
+    def update_counters(self, instance, delta):
+        """
+        Изменение счетчиков, связанных с объектом instance, на delta.
+        """
+        pass
 
     def delete(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -47,11 +79,121 @@ class CartFavoriteBaseViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class CartFavoriteBulkView(APIView):
+    """
+    Базовое представление для добавления (POST) и удаления (DELETE)
+    нескольких рецептов в корзину покупок или в избранное одним
+    запросом: {"recipes": [id, ...]} (для DELETE также ?recipes=1,2).
+
+    Рецепты и их наличие в списке проверяются одним запросом,
+    добавление - один bulk_create, удаление - один DELETE.
+    В ответе результат для каждого id: added, exists, removed
+    или not_found.
+    """
+    model = None
+    permission_classes = [IsAuthenticated]
+
+    def get_recipe_ids(self, request):
+        data = request.data
+        if not data and 'recipes' in request.query_params:
+            data = {'recipes': [
+                recipe_id
+                for value in request.query_params.getlist('recipes')
+                for recipe_id in value.split(',') if recipe_id
+            ]}
+        serializer = RecipeIdsSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(serializer.validated_data['recipes']))
+
+    def get_present(self, recipe_ids):
+        """
+        Словарь {id рецепта: есть ли рецепт в списке пользователя}
+        для существующих рецептов из recipe_ids.
+        """
+        return dict(Recipe.objects.filter(id__in=recipe_ids).annotate(
+            present=Exists(self.model.objects.filter(
+                recipe=OuterRef('pk'), user=self.request.user
+            ))
+        ).order_by().values_list('id', 'present'))
+
+    def get_response(self, recipe_ids, present, done, status_done,
+                     status_skipped):
+        return Response({'results': [
+            {
+                'id': recipe_id,
+                'status': (
+                    'not_found' if recipe_id not in present
+                    else status_done if recipe_id in done
+                    else status_skipped
+                ),
+            }
+            for recipe_id in recipe_ids
+        ]})
+
+    def post(self, request):
+        user = request.user
+        recipe_ids = self.get_recipe_ids(request)
+        present = self.get_present(recipe_ids)
+        added = [
+            recipe_id for recipe_id in recipe_ids
+            if recipe_id in present and not present[recipe_id]
+        ]
+        if added:
+            with transaction.atomic():
+                self.model.objects.bulk_create(
+                    (
+                        self.model(user=user, recipe_id=recipe_id)
+                        for recipe_id in added
+                    ),
+                    ignore_conflicts=True
+                )
+                self.update_counters(user, added, 1)
+            self.invalidate(user)
+        return self.get_response(
+            recipe_ids, present, set(added), 'added', 'exists'
+        )
+
+    def delete(self, request):
+        user = request.user
+        recipe_ids = self.get_recipe_ids(request)
+        present = self.get_present(recipe_ids)
+        removed = [
+            recipe_id for recipe_id in recipe_ids if present.get(recipe_id)
+        ]
+        if removed:
+            with transaction.atomic():
+                self.model.objects.filter(
+                    user=user, recipe_id__in=removed
+                ).delete()
+                self.update_counters(user, removed, -1)
+            self.invalidate(user)
+        return self.get_response(
+            recipe_ids, present, set(removed), 'removed', 'not_found'
+        )
+
+    def update_counters(self, user, recipe_ids, delta):
+        """
+        Изменение счетчиков при добавлении (delta=1) или удалении
+        (delta=-1) рецептов recipe_ids.
+        """
+        pass
+
+    def invalidate(self, user):
+        invalidate_user_state([user.id])
+
+
 class FoodgramUserViewSet(UserViewSet):
     """
     Обработка пользователей.
     """
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        selection = UserSerializer.get_selection(self.request)
+        if selection is not None and 'is_subscribed' not in selection[0]:
+            return queryset
+        return queryset.with_is_subscribed(self.request.user)
+
     @action(["get", "delete"], detail=False,
             permission_classes=[CurrentUserOrAdmin], name='me')
     def me(self, request, *args, **kwargs):
@@ -62,39 +204,108 @@ class FoodgramUserViewSet(UserViewSet):
             return self.destroy(request, *args, **kwargs)
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class TagsViewSet(ResponseCacheMixin, viewsets.ReadOnlyModelViewSet):
     """
     Обработка тэгов.
     """
+    cache_scopes = ('tags',)
     serializer_class = TagsSerializer
     queryset = Tag.objects.all()
     permission_classes = [IsAdminOrReadOnly]
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(ResponseCacheMixin, viewsets.ReadOnlyModelViewSet):
     """
     Обработка ингредиентов.
     """
+    cache_scopes = ('ingredients',)
     serializer_class = IngredientsSerializer
     queryset = Ingredient.objects.all()
     permission_classes = [IsAdminOrReadOnly]
-    filter_backends = (filters.DjangoFilterBackend,)
-    filter_class = IngredientsFilter
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список ингредиентов; с ?name= - поиск по началу названия
+        (с ?contains=1 - и по вхождению) в индексе ingredient_index.
+        """
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(
+            name,
+            contains=request.query_params.get('contains') == '1'
+        ))
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(ResponseCacheMixin, viewsets.ModelViewSet):
     """
     Обработка рецептов.
+
+    Изображение передается строкой base64 в JSON или файлом в запросе
+    multipart/form-data (тэги - повторяющимся полем tags, ингредиенты -
+    полями ingredients[0]id, ingredients[0]amount и т.д.).
     """
+    cache_scopes = ('recipes', 'tags', 'ingredients')
+    use_user_state = True
     serializer_class = RecipesSerializerRead
     queryset = Recipe.objects.all()
     permission_classes = [IsAuthorOrAdminOrReadOnly]
+    parser_classes = (JSONParser, RecipeMultiPartParser)
     pagination_class = PageLimitPagination
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = RecipeFilter
+    feed_cursor_ordering = ('-pub_time', '-recipe_id')
+
+    def get_cursor_ordering(self):
+        if self.action == 'feed':
+            return self.feed_cursor_ordering
+        return None
+
+    def get_queryset(self):
+        if self.action in ['list', 'retrieve']:
+            return Recipe.objects.for_read(
+                self.get_response_user(),
+                *(RecipesSerializerRead.get_selection(self.request) or ())
+            )
+        return Recipe.objects.all()
+
+    def get_cache_scopes(self, request):
+        """
+        Сортировка по оценкам популярности зависит еще и от поколения
+        'rankings', которое сбрасывается после пересчета оценок.
+        """
+        if request.query_params.get('ordering') in ('popular', 'trending'):
+            return (*self.cache_scopes, 'rankings')
+        return self.cache_scopes
+
+    def is_shared_request(self, request):
+        return all(
+            request.query_params.get(name, '0') in ('', '0')
+            for name in ('is_favorited', 'is_in_shopping_cart')
+        )
+
+    def get_recipes_data(self, data):
+        return data['results'] if self.action == 'list' else [data]
+
+    def apply_user_state(self, data, state):
+        for recipe in self.get_recipes_data(data):
+            RecipesSerializerRead.apply_user_state(recipe, state)
+        return data
+
+    def remove_overlay_fields(self, data, request):
+        selection = RecipesSerializerRead.get_selection(request)
+        if selection is None:
+            return data
+        names = set(RecipesSerializerRead.overlay_fields) - selection[0]
+        for recipe in self.get_recipes_data(data):
+            for name in names:
+                recipe.pop(name, None)
+        return data
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        with transaction.atomic():
+            recipe = serializer.save(author=self.request.user)
+            add_recipe_to_feeds(recipe)
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
@@ -107,6 +318,65 @@ class RecipesViewSet(viewsets.ModelViewSet):
     def partial_update(self, request, *args, **kwargs):
         return super().update(request, *args, **kwargs, partial=True)
 
+    @action(['get'], detail=False, url_path='what_to_cook')
+    def what_to_cook(self, request):
+        """
+        Рецепты, которые можно приготовить из имеющихся ингредиентов
+        (?ingredients=1,2,3), по убыванию доли имеющихся ингредиентов.
+        """
+        try:
+            ingredient_ids = {
+                int(ingredient_id)
+                for value in request.query_params.getlist('ingredients')
+                for ingredient_id in value.split(',') if ingredient_id
+            }
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'A list of ingredient ids is required.'}
+            )
+        limit = self.paginator.get_page_size(request)
+        matches = recipe_ingredient_index.match(ingredient_ids, limit)
+        recipes = Recipe.objects.for_read(request.user).in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        result = []
+        for recipe_id, coverage, missing in matches:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage = coverage
+                recipe.missing_ingredients = missing
+                result.append(recipe)
+        return Response(RecipeMatchSerializer(
+            result, many=True, context=self.get_serializer_context()
+        ).data)
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """
+        Лента: рецепты авторов, на которых подписан пользователь,
+        от новых к старым. Страница выбирается по индексу ленты
+        пользователя, затем загружаются рецепты этой страницы.
+        """
+        items = self.paginate_queryset(
+            FeedItem.objects.filter(user=request.user).order_by(
+                *self.feed_cursor_ordering
+            )
+        )
+        recipes = Recipe.objects.for_read(
+            request.user,
+            *(RecipesSerializerRead.get_selection(request) or ())
+        ).in_bulk(
+            [item.recipe_id for item in items]
+        )
+        return self.get_paginated_response(RecipesSerializerRead(
+            [
+                recipes[item.recipe_id] for item in items
+                if item.recipe_id in recipes
+            ],
+            many=True,
+            context=self.get_serializer_context()
+        ).data)
+
 
 class SubscriptionsListViewSet(generics.ListAPIView):
     """
@@ -115,10 +385,13 @@ class SubscriptionsListViewSet(generics.ListAPIView):
     serializer_class = SubscriptionsSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = PageLimitPagination
+    cursor_ordering = ('-id',)
 
     def get_queryset(self):
         user = self.request.user
-        return Subscription.objects.filter(user=user)
+        return Subscription.objects.filter(user=user).select_related(
+            'author'
+        ).order_by('-id')
 
 
 class SubscribeViewSet(viewsets.ModelViewSet):
@@ -133,7 +406,16 @@ class SubscribeViewSet(viewsets.ModelViewSet):
         user = self.request.user
         author_id = self.kwargs.get('author_id')
         author = get_object_or_404(User, id=author_id)
-        serializer.save(author=author, user=user)
+        with transaction.atomic():
+            serializer.save(author=author, user=user)
+            add_author_to_feed(user.id, author.id)
+        invalidate_user_state([user.id])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            remove_author_from_feed(instance.user_id, instance.author_id)
+        invalidate_user_state([instance.user_id])
 
     def delete(self, request, *args, **kwargs):
         author_id = self.kwargs.get('author_id')
@@ -154,6 +436,17 @@ class CartViewSet(CartFavoriteBaseViewSet):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        invalidate_shopping_cart([self.request.user.id])
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        invalidate_shopping_cart([instance.user_id])
+
+    def update_counters(self, instance, delta):
+        update_counter(User, [instance.user_id], 'cart_count', delta)
+
 
 class FavoriteViewSet(CartFavoriteBaseViewSet):
     """
@@ -163,27 +456,63 @@ class FavoriteViewSet(CartFavoriteBaseViewSet):
     serializer_class = FavoriteSerializer
     permission_classes = [IsAuthenticated]
 
+    def update_counters(self, instance, delta):
+        update_counter(Recipe, [instance.recipe_id], 'favorites_count', delta)
+
+
+class CartBulkView(CartFavoriteBulkView):
+    """
+    Добавление/удаление нескольких рецептов в корзине покупок.
+    """
+    model = Cart
+
+    def update_counters(self, user, recipe_ids, delta):
+        update_counter(User, [user.id], 'cart_count', delta * len(recipe_ids))
+
+    def invalidate(self, user):
+        super().invalidate(user)
+        invalidate_shopping_cart([user.id])
+
+
+class FavoriteBulkView(CartFavoriteBulkView):
+    """
+    Добавление/удаление нескольких рецептов в избранном.
+    """
+    model = Favorite
+
+    def update_counters(self, user, recipe_ids, delta):
+        update_counter(Recipe, recipe_ids, 'favorites_count', delta)
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes([ShoppingCartTextRenderer, ShoppingCartCSVRenderer,
+                   ShoppingCartJSONRenderer, ShoppingCartPDFRenderer])
 def download_shopping_cart(request):
     """
     Получение перечня ингредиентов для рецептов в корзине
-    и отпавка в виде текстового файла.
-    """
-    user = request.user
-    ingredients = RecipesIngredient.objects.filter(
-        recipe__cart_recipe__user=user.id
-    ).values(
-        'ingredient__name', 'ingredient__measurement_unit'
-    ).annotate(Sum('amount'))
-    if not ingredients.exists():
+    и отпавка в виде файла (?format=txt|csv|json|pdf).
+    """
+    renderer = request.accepted_renderer
+    version = get_shopping_cart_version(request.user.id)
+    etag = f'"{version}-{renderer.format}"'
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+    rows = get_shopping_cart_snapshot(request.user, version)
+    if not rows:
         return Response('Shopping cart is empty')
-    text = 'Для приготовления выбранных рецептов Вам понадобится:\n\n'
-    for ingredient in ingredients:
-        text += (
-            ingredient['ingredient__name'] + ' - '
-            + str(ingredient['amount__sum']) + ' '
-            + ingredient['ingredient__measurement_unit'] + '.\n'
+    response = StreamingHttpResponse(
+        renderer.stream(rows),
+        content_type=(
+            f'{renderer.media_type}; charset={renderer.charset}'
+            if renderer.charset else renderer.media_type
         )
-    return HttpResponse(text, content_type='text/plain')
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_cart.{renderer.format}"'
+    )
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,44 @@
+"""
+Настройки gunicorn. Все параметры задаются переменными окружения.
+
+По умолчанию запускается 2 * CPU + 1 процессов gthread по 4 потока,
+приложение загружается до создания процессов (preload), процессы
+перезапускаются после GUNICORN_MAX_REQUESTS запросов со случайным
+разбросом, чтобы не перезапускаться одновременно.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+workers = int(
+    os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+
+def on_starting(server):
+    """
+    Кэш в памяти процесса (по умолчанию) не разделяется между
+    процессами gunicorn и management-командами: версии ответов
+    и индексов в разных процессах расходились бы.
+    """
+    if workers > 1 and 'CACHE_BACKEND' not in os.environ:
+        server.log.warning(
+            'CACHE_BACKEND is not set: each of %s workers uses its own '
+            'cache. Configure a shared cache such as memcached.', workers
+        )
+
+
+def post_fork(server, worker):
+    """
+    Соединения с БД, открытые при загрузке приложения (preload),
+    не используются процессами совместно.
+    """
+    from django.db import connections
+    connections.close_all()
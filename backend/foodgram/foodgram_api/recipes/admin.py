@@ -1,16 +1,45 @@
 from django.contrib import admin
 
-from .models import Favorite, Ingredient, Recipe, Tag
+from .images import delete_image_files_on_commit, enqueue_recipe_image
+from .models import ImageTask, Ingredient, Recipe, Tag
+from .search import search_recipes, update_search_index
 
 
 @admin.register(Recipe)
 class RecipesAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorited')
+    list_display = ('name', 'author', 'favorites_count')
+    list_select_related = ('author',)
     search_fields = ('name',)
     list_filter = ('name', 'author', 'tags')
 
-    def favorited(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search_recipes(queryset, search_term), False
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_search_index([form.instance.id])
+
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            if change:
+                old = Recipe.objects.values_list(
+                    'image', 'image_width'
+                ).get(pk=obj.pk)
+                delete_image_files_on_commit(*old)
+            obj.image_width = None
+            obj.image_status = Recipe.IMAGE_PENDING
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            enqueue_recipe_image(obj, created=not change)
+
+
+@admin.register(ImageTask)
+class ImageTasksAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'attempts', 'run_at', 'error')
+    list_select_related = ('recipe',)
+    readonly_fields = ('recipe', 'error')
 
 
 @admin.register(Ingredient)
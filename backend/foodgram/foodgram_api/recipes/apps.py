@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
     verbose_name = 'Справочник рецептов'
+
+    def ready(self):
+        from .signals import create_database_extras
+        post_migrate.connect(create_database_extras, sender=self)
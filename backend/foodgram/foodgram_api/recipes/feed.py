@@ -0,0 +1,60 @@
+from django.db import connection
+
+from .models import FeedItem, Recipe
+from users.models import Subscription
+
+FILL_FEEDS = f"""
+    INSERT INTO {FeedItem._meta.db_table} (user_id, recipe_id, pub_time)
+    SELECT subscription.user_id, recipe.id, recipe.pub_time
+    FROM {Subscription._meta.db_table} AS subscription
+    JOIN {Recipe._meta.db_table} AS recipe
+        ON recipe.author_id = subscription.author_id
+    WHERE {{condition}} AND NOT EXISTS (
+        SELECT 1 FROM {FeedItem._meta.db_table} AS item
+        WHERE item.user_id = subscription.user_id
+            AND item.recipe_id = recipe.id
+    )
+"""
+
+
+def fill_feeds(condition='1 = 1', params=()):
+    """
+    Добавление в ленты подписчиков рецептов их авторов одним запросом
+    INSERT ... SELECT; condition - условие на subscription и recipe.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(FILL_FEEDS.format(condition=condition), params)
+
+
+def add_recipe_to_feeds(recipe):
+    """
+    Добавление нового рецепта в ленты подписчиков автора.
+    """
+    fill_feeds('recipe.id = %s', [recipe.id])
+
+
+def add_author_to_feed(user_id, author_id):
+    """
+    Добавление рецептов автора в ленту нового подписчика.
+    """
+    fill_feeds(
+        'subscription.user_id = %s AND subscription.author_id = %s',
+        [user_id, author_id]
+    )
+
+
+def remove_author_from_feed(user_id, author_id):
+    """
+    Удаление рецептов автора из ленты пользователя при отписке.
+    """
+    FeedItem.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def rebuild_feeds():
+    """
+    Перестроение лент всех пользователей.
+    """
+    FeedItem.objects.all().delete()
+    fill_feeds()
@@ -0,0 +1,249 @@
+import os
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ImageTask, Recipe
+
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+VARIANTS_DIR = 'recipes/variants'
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(minutes=1)
+LEASE_TIME = timedelta(minutes=10)
+
+
+def get_variant_name(name, width, extension):
+    """
+    Имя файла варианта изображения name шириной width.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f'{VARIANTS_DIR}/{stem}_{width}.{extension}'
+
+
+def get_variant_widths(image_width):
+    """
+    Ширины вариантов изображения исходной ширины image_width:
+    ширины из RECIPE_IMAGE_WIDTHS меньше исходной и сама исходная.
+    """
+    widths = [
+        width for width in settings.RECIPE_IMAGE_WIDTHS
+        if width < image_width
+    ]
+    return widths + [image_width]
+
+
+def get_extension(name):
+    return os.path.splitext(name)[1].lstrip('.')
+
+
+def delete_image_files(name, image_width=None):
+    """
+    Удаление изображения name и, если оно обработано (известна
+    исходная ширина image_width), всех его вариантов.
+    """
+    if not name:
+        return
+    default_storage.delete(name)
+    if not image_width:
+        return
+    for width in get_variant_widths(image_width):
+        for extension in (get_extension(name), 'webp'):
+            default_storage.delete(get_variant_name(name, width, extension))
+
+
+def delete_image_files_on_commit(name, image_width=None):
+    """
+    Удаление файлов изображения после фиксации транзакции:
+    при ее откате строка рецепта снова ссылается на эти файлы.
+    """
+    transaction.on_commit(lambda: delete_image_files(name, image_width))
+
+
+def encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def save_variants(image, name, extension):
+    """
+    Сохранение уменьшенных копий image и их WebP-вариантов.
+    Каждая копия получается из предыдущей (большей), поэтому исходное
+    изображение масштабируется только один раз.
+    """
+    image_format = 'PNG' if extension == 'png' else 'JPEG'
+    for width in sorted(get_variant_widths(image.width), reverse=True):
+        if width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        for variant_format, variant_extension, options in (
+            (image_format, extension, {'quality': JPEG_QUALITY}),
+            ('WEBP', 'webp', {'quality': WEBP_QUALITY}),
+        ):
+            variant_name = get_variant_name(name, width, variant_extension)
+            default_storage.delete(variant_name)
+            default_storage.save(
+                variant_name, encode(image, variant_format, **options)
+            )
+
+
+def process_recipe_image(recipe):
+    """
+    Обработка загруженного изображения рецепта.
+
+    Изображение декодируется один раз, поворачивается согласно EXIF
+    и пересохраняется без метаданных (JPEG, PNG для изображений
+    с прозрачностью). Затем сохраняются копии шириной
+    RECIPE_IMAGE_WIDTHS в исходном формате и в WebP, а в поле
+    image_width записывается ширина исходного изображения.
+
+    Новое изображение сохраняется под свободным именем, а исходный
+    файл удаляется только после обновления строки рецепта, поэтому
+    рецепт всегда ссылается на существующий файл.
+
+    Возвращает False, если за время обработки изображение рецепта
+    было заменено или рецепт удален: результат тогда не сохраняется,
+    а его файлы удаляются.
+    """
+    old_name = recipe.image.name
+    with recipe.image.open('rb') as file:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        extension, content = 'png', encode(image, 'PNG', optimize=True)
+    else:
+        image = image.convert('RGB')
+        extension, content = 'jpg', encode(
+            image, 'JPEG', quality=JPEG_QUALITY, optimize=True
+        )
+    stem = os.path.splitext(old_name)[0]
+    name = default_storage.save(f'{stem}.{extension}', content)
+    try:
+        save_variants(image, name, extension)
+    except Exception:
+        delete_image_files(name, image.width)
+        raise
+    with transaction.atomic():
+        current = Recipe.objects.select_for_update().filter(
+            pk=recipe.pk
+        ).values_list('image', 'image_width').first()
+        if current is None or current[0] != old_name:
+            delete_image_files(name, image.width)
+            return False
+        recipe.image.name = name
+        recipe.image_width = image.width
+        recipe.image_status = Recipe.IMAGE_READY
+        recipe.save(update_fields=['image', 'image_width', 'image_status'])
+    delete_image_files_on_commit(old_name, current[1])
+    return True
+
+
+def enqueue_recipe_image(recipe, created=False):
+    """
+    Постановка изображения рецепта в очередь обработки.
+
+    Повторная загрузка изображения сбрасывает существующее задание,
+    в том числе уже взятое в работу; для нового рецепта (created)
+    задание сразу создается. Если очередь отключена
+    (RECIPE_IMAGE_QUEUE), изображение обрабатывается сразу.
+    """
+    if not settings.RECIPE_IMAGE_QUEUE:
+        process_recipe_image(recipe)
+        return
+    updated = not created and ImageTask.objects.filter(
+        recipe=recipe
+    ).update(attempts=0, run_at=timezone.now(), error='')
+    if not updated:
+        ImageTask.objects.create(recipe=recipe)
+
+
+def claim_image_tasks(limit):
+    """
+    Взятие в работу не более limit готовых к выполнению заданий.
+
+    Задания блокируются с SKIP LOCKED, поэтому несколько обработчиков
+    не берут одно задание. Время выполнения сдвигается на LEASE_TIME:
+    если обработчик завершится аварийно, задание будет взято снова.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            ImageTask.objects.select_for_update(skip_locked=True).filter(
+                run_at__lte=now, attempts__lt=MAX_ATTEMPTS
+            ).values_list('id', flat=True)[:limit]
+        )
+        ImageTask.objects.filter(id__in=ids).update(run_at=now + LEASE_TIME)
+    return list(
+        ImageTask.objects.filter(id__in=ids).select_related('recipe')
+    )
+
+
+def run_image_task(task):
+    """
+    Выполнение задания, взятого claim_image_tasks.
+
+    При ошибке задание повторяется с экспоненциальной задержкой;
+    после MAX_ATTEMPTS неудачных попыток изображение рецепта
+    помечается как необработанное (IMAGE_FAILED), а задание остается
+    в очереди с текстом ошибки. Задание, сброшенное повторной загрузкой
+    изображения во время обработки, не изменяется.
+    """
+    claimed = ImageTask.objects.filter(pk=task.pk, run_at=task.run_at)
+    try:
+        process_recipe_image(task.recipe)
+    except Exception as error:
+        attempts = task.attempts + 1
+        failed = attempts >= MAX_ATTEMPTS
+        updated = claimed.update(
+            attempts=attempts,
+            run_at=timezone.now() + RETRY_DELAY * 2 ** (attempts - 1),
+            error=repr(error),
+        )
+        if updated and failed:
+            task.recipe.image_status = Recipe.IMAGE_FAILED
+            task.recipe.save(update_fields=['image_status'])
+        return False
+    claimed.delete()
+    return True
+
+
+def get_thumb_url(recipe):
+    """
+    Адрес уменьшенной копии изображения рецепта
+    (исходного изображения, если оно еще не обработано).
+    """
+    if not recipe.image:
+        return None
+    if not recipe.image_width:
+        return recipe.image.url
+    width = get_variant_widths(recipe.image_width)[0]
+    return default_storage.url(get_variant_name(
+        recipe.image.name, width, get_extension(recipe.image.name)
+    ))
+
+
+def get_srcset(recipe):
+    """
+    Значение атрибута srcset из WebP-вариантов изображения рецепта.
+    """
+    if not recipe.image or not recipe.image_width:
+        return None
+    return ', '.join(
+        '{} {}w'.format(
+            default_storage.url(
+                get_variant_name(recipe.image.name, width, 'webp')
+            ),
+            width
+        )
+        for width in get_variant_widths(recipe.image_width)
+    )
@@ -1,4 +1,9 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, Window)
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 
 from users.models import User
 
@@ -42,13 +47,149 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиенты'
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['name'],
+                name='ingredient_name_pattern_idx',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self, user):
+        """
+        Загрузка связанных объектов, необходимых для вывода рецептов:
+        автор (с признаком подписки), тэги и ингредиенты.
+        """
+        return self.prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.with_is_subscribed(user)
+            ),
+            'tags',
+            Prefetch(
+                'recipesingredient_set',
+                queryset=RecipesIngredient.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """
+        Аннотация признаков нахождения рецепта в избранном
+        и в корзине покупок пользователя user.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(recipe=OuterRef('pk'), user=user)
+            ),
+            is_in_shopping_cart=Exists(
+                Cart.objects.filter(recipe=OuterRef('pk'), user=user)
+            ),
+        )
+
+    def latest_by_author(self, author_ids, limit=None):
+        """
+        Последние рецепты авторов author_ids одним запросом:
+        словарь {id автора: [рецепты]}.
+
+        При заданном limit для каждого автора выбирается не более limit
+        рецептов с помощью ROW_NUMBER() OVER (PARTITION BY author).
+        """
+        author_ids = list(author_ids)
+        recipes = {author_id: [] for author_id in author_ids}
+        if not author_ids:
+            return recipes
+        queryset = self.filter(author_id__in=author_ids)
+        if limit is None:
+            queryset = queryset.order_by('-pub_time', '-id')
+        else:
+            ranked = queryset.annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('author_id')],
+                    order_by=[F('pub_time').desc(), F('id').desc()],
+                )
+            ).values(
+                'id', 'author_id', 'name', 'image', 'image_width',
+                'cooking_time', 'pub_time', 'row_number'
+            )
+            sql, params = ranked.query.sql_with_params()
+            queryset = self.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                f'WHERE "row_number" <= %s '
+                f'ORDER BY "author_id", "row_number"',
+                (*params, limit)
+            )
+        for recipe in queryset:
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
+    def for_read(self, user, fields=None, expand=()):
+        """
+        Рецепты со всеми данными для сериализатора чтения:
+        постоянное число запросов независимо от размера страницы.
+
+        fields - выбранные поля сериализатора (None - все поля):
+        связанные объекты и аннотации для остальных полей
+        не загружаются, описание не читается из БД. Для вложенных
+        объектов не из expand загружаются только их id.
+        """
+        if fields is None:
+            return self.with_related(user).with_user_flags(user)
+        queryset = self
+        if 'author' in expand:
+            queryset = queryset.prefetch_related(Prefetch(
+                'author',
+                queryset=User.objects.with_is_subscribed(user)
+            ))
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related(
+                'tags' if 'tags' in expand
+                else Prefetch('tags', queryset=Tag.objects.only('id'))
+            )
+        if 'ingredients' in fields:
+            items = RecipesIngredient.objects.all()
+            if 'ingredients' in expand:
+                items = items.select_related('ingredient')
+            queryset = queryset.prefetch_related(
+                Prefetch('recipesingredient_set', queryset=items)
+            )
+        if 'text' not in fields:
+            queryset = queryset.defer('description')
+        if {'is_favorited', 'is_in_shopping_cart'} & set(fields):
+            queryset = queryset.with_user_flags(user)
+        return queryset
+
+
 class Recipe(models.Model):
 
+    IMAGE_PENDING = 'pending'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_PENDING, 'pending'),
+        (IMAGE_READY, 'ready'),
+        (IMAGE_FAILED, 'failed'),
+    )
+
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -63,6 +204,18 @@ class Recipe(models.Model):
         verbose_name='image',
         upload_to='recipes/',
     )
+    image_width = models.PositiveIntegerField(
+        verbose_name='image_width',
+        null=True,
+        editable=False,
+    )
+    image_status = models.CharField(
+        verbose_name='image_status',
+        max_length=16,
+        choices=IMAGE_STATUSES,
+        default=IMAGE_PENDING,
+        editable=False,
+    )
     description = models.TextField(
         verbose_name='description'
     )
@@ -83,16 +236,71 @@ class Recipe(models.Model):
         auto_now_add=True,
         editable=False,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='favorites_count',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='search_vector',
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепты'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_time']
+        indexes = [
+            models.Index(
+                fields=['-pub_time', '-id'],
+                name='recipe_pub_time_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class ImageTask(models.Model):
+    """
+    Задание очереди обработки изображения рецепта.
+
+    Задание удаляется после успешной обработки. run_at - время,
+    не раньше которого задание может быть взято в работу: при взятии
+    оно сдвигается на время аренды, при ошибке - на время до повтора.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='image_task',
+        verbose_name='recipe'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='attempts',
+        default=0
+    )
+    run_at = models.DateTimeField(
+        verbose_name='run_at',
+        default=timezone.now,
+        db_index=True
+    )
+    error = models.TextField(
+        verbose_name='error',
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = 'Обработка изображений'
+        verbose_name_plural = 'Обработка изображений'
+        ordering = ['run_at']
+
+    def __str__(self):
+        return str(self.recipe)
+
+
 class RecipesIngredient(models.Model):
 
     recipe = models.ForeignKey(
@@ -110,10 +318,53 @@ class RecipesIngredient(models.Model):
     class Meta:
         verbose_name = 'Состав'
         verbose_name_plural = 'Состав'
-        models.UniqueConstraint(
-            fields=['recipe', 'ingredient'],
-            name='unique_ingredient_in_recipe'
-        )
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_ingredient_in_recipe'
+            ),
+        ]
+
+
+class FeedItem(models.Model):
+    """
+    Лента пользователя: рецепты авторов, на которых он подписан.
+
+    Строки добавляются при публикации рецепта и при подписке,
+    поэтому чтение ленты - один проход по индексу (user, pub_time).
+    pub_time - копия времени публикации рецепта.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='user'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='recipe'
+    )
+    pub_time = models.DateTimeField(
+        verbose_name='pub_date'
+    )
+
+    class Meta:
+        verbose_name = 'Лента'
+        verbose_name_plural = 'Лента'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_item'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_time', '-recipe'],
+                name='feed_user_pub_time_idx'
+            ),
+        ]
 
 
 class Cart(models.Model):
@@ -130,14 +381,22 @@ class Cart(models.Model):
         related_name='cart_user',
         verbose_name='user'
     )
+    created = models.DateTimeField(
+        verbose_name='created',
+        default=timezone.now,
+        db_index=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Покупки'
         verbose_name_plural = 'Покупки'
-        models.UniqueConstraint(
-            fields=['recipe', 'user'],
-            name='unique_sopping_cart'
-        )
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'user'],
+                name='unique_sopping_cart'
+            ),
+        ]
 
 
 class Favorite(models.Model):
@@ -154,11 +413,58 @@ class Favorite(models.Model):
         related_name='favorite_user',
         verbose_name='user'
     )
+    created = models.DateTimeField(
+        verbose_name='created',
+        default=timezone.now,
+        db_index=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
-        models.UniqueConstraint(
-            fields=['recipe', 'user'],
-            name='unique_favorited'
-        )
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'user'],
+                name='unique_favorited'
+            ),
+        ]
+
+
+class RecipeRanking(models.Model):
+    """
+    Оценки популярности рецептов, пересчитываемые командой rankings.
+
+    Связь без ограничения внешнего ключа: удаление рецепта не требует
+    удаления оценки, строки удаленных рецептов исчезают при пересчете.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        primary_key=True,
+        related_name='ranking',
+        verbose_name='recipe'
+    )
+    popular = models.FloatField(
+        verbose_name='popular',
+        default=0
+    )
+    trending = models.FloatField(
+        verbose_name='trending',
+        default=0
+    )
+
+    class Meta:
+        verbose_name = 'Рейтинг'
+        verbose_name_plural = 'Рейтинг'
+        indexes = [
+            models.Index(
+                fields=['-popular'],
+                name='ranking_popular_idx'
+            ),
+            models.Index(
+                fields=['-trending'],
+                name='ranking_trending_idx'
+            ),
+        ]
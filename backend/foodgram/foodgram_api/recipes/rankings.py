@@ -0,0 +1,68 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import Cart, Favorite, RecipeRanking
+
+POPULAR_HALF_LIFE = timedelta(days=30)
+TRENDING_HALF_LIFE = timedelta(days=1)
+TRENDING_WINDOW = timedelta(days=7)
+ACTIVITY_WEIGHTS = ((Favorite, 1.0), (Cart, 0.5))
+
+
+def get_activity(model, trunc, since=None):
+    """
+    Число добавлений рецептов в model, сгруппированное по рецепту
+    и интервалу времени trunc (день, час): одна строка на рецепт
+    и интервал вместо строки на каждое добавление.
+    """
+    queryset = model.objects.all()
+    if since is not None:
+        queryset = queryset.filter(created__gte=since)
+    return queryset.annotate(period=trunc('created')).order_by().values_list(
+        'recipe_id', 'period'
+    ).annotate(count=Count('id')).iterator()
+
+
+def decay(age, half_life):
+    return 0.5 ** (max(age, timedelta(0)) / half_life)
+
+
+def compute_rankings(now=None):
+    """
+    Пересчет оценок популярности всех рецептов.
+
+    popular - добавления в избранное и в корзину за все время,
+    вес добавления уменьшается вдвое за POPULAR_HALF_LIFE;
+    trending - добавления за TRENDING_WINDOW с периодом полураспада
+    TRENDING_HALF_LIFE. Таблица оценок заменяется целиком.
+    """
+    now = now or timezone.now()
+    scores = defaultdict(lambda: [0.0, 0.0])
+    for model, weight in ACTIVITY_WEIGHTS:
+        for recipe_id, period, count in get_activity(model, TruncDay):
+            scores[recipe_id][0] += (
+                weight * count * decay(now - period, POPULAR_HALF_LIFE)
+            )
+        for recipe_id, period, count in get_activity(
+            model, TruncHour, now - TRENDING_WINDOW
+        ):
+            scores[recipe_id][1] += (
+                weight * count * decay(now - period, TRENDING_HALF_LIFE)
+            )
+    with transaction.atomic():
+        RecipeRanking.objects.all().delete()
+        RecipeRanking.objects.bulk_create(
+            (
+                RecipeRanking(
+                    recipe_id=recipe_id, popular=popular, trending=trending
+                )
+                for recipe_id, (popular, trending) in scores.items()
+            ),
+            batch_size=1000
+        )
+    return len(scores)
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'recipes_recipe_fts'
+
+POSTGRESQL_UPDATE = """
+    UPDATE recipes_recipe AS recipe SET search_vector =
+        setweight(to_tsvector(%(config)s, recipe.name), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_recipesingredient AS item
+            JOIN recipes_ingredient AS ingredient
+                ON ingredient.id = item.ingredient_id
+            WHERE item.recipe_id = recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector(%(config)s, recipe.description), 'C')
+"""
+
+SQLITE_INSERT = f"""
+    INSERT INTO {FTS_TABLE} (rowid, name, ingredients, description)
+    SELECT recipe.id, recipe.name, coalesce((
+        SELECT group_concat(ingredient.name, ' ')
+        FROM recipes_recipesingredient AS item
+        JOIN recipes_ingredient AS ingredient
+            ON ingredient.id = item.ingredient_id
+        WHERE item.recipe_id = recipe.id
+    ), ''), recipe.description
+    FROM recipes_recipe AS recipe
+"""
+
+
+class RawSubquery(RawSQL):
+    """
+    Подзапрос для условия id__in: в Django 2.2 условие IN само
+    заключает подзапрос в скобки, а двойные скобки SQLite
+    понимает как скалярный подзапрос (только первая строка).
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def update_search_index(recipe_ids=None):
+    """
+    Обновление поискового индекса рецептов recipe_ids
+    (всех рецептов, если recipe_ids не указан).
+
+    Индекс строится по названию, ингредиентам и описанию рецепта:
+    столбец search_vector (tsvector) в PostgreSQL,
+    таблица FTS5 recipes_recipe_fts в SQLite.
+    """
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            sql = POSTGRESQL_UPDATE
+            params = {'config': settings.SEARCH_CONFIG}
+            if recipe_ids is not None:
+                sql += ' WHERE recipe.id = ANY(%(ids)s)'
+                params['ids'] = recipe_ids
+            cursor.execute(sql, params)
+        elif connection.vendor == 'sqlite':
+            if recipe_ids is None:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+                cursor.execute(SQLITE_INSERT)
+                return
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} '
+                f'WHERE rowid IN ({placeholders(recipe_ids)})',
+                recipe_ids
+            )
+            cursor.execute(
+                f'{SQLITE_INSERT} WHERE recipe.id IN '
+                f'({placeholders(recipe_ids)})',
+                recipe_ids
+            )
+
+
+def delete_from_search_index(recipe_ids):
+    """
+    Удаление рецептов из таблицы FTS5 (в PostgreSQL индекс
+    хранится в самой таблице рецептов).
+    """
+    recipe_ids = list(recipe_ids)
+    if connection.vendor != 'sqlite' or not recipe_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} '
+            f'WHERE rowid IN ({placeholders(recipe_ids)})',
+            recipe_ids
+        )
+
+
+def get_fts_query(text):
+    """
+    Запрос FTS5: все слова text как префиксы, через AND.
+    """
+    return ' '.join(
+        '"{}"*'.format(word.replace('"', '""')) for word in text.split()
+    )
+
+
+def search_recipes(queryset, text):
+    """
+    Рецепты queryset, найденные по тексту text, упорядоченные
+    по релевантности (аннотация search_rank).
+
+    В PostgreSQL используются ts_rank и GIN-индекс по search_vector,
+    в SQLite - bm25 по таблице FTS5, для остальных СУБД - поиск
+    подстроки в названии, описании и ингредиентах.
+    """
+    if not text.split():
+        return queryset
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, config=settings.SEARCH_CONFIG)
+        queryset = queryset.annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).filter(search_vector=query)
+    elif connection.vendor == 'sqlite':
+        match = get_fts_query(text)
+        queryset = queryset.annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({FTS_TABLE}, 10.0, 5.0, 1.0) '
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'AND rowid = recipes_recipe.id',
+                (match,),
+                output_field=FloatField()
+            )
+        ).filter(id__in=RawSubquery(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,)
+        ))
+    else:
+        condition = Q()
+        for word in text.split():
+            condition &= (
+                Q(name__icontains=word)
+                | Q(description__icontains=word)
+                | Q(ingredients__name__icontains=word)
+            )
+        return queryset.filter(
+            id__in=queryset.model.objects.filter(condition).values('id')
+        )
+    return queryset.order_by('-search_rank', '-pub_time', '-id')
@@ -0,0 +1,62 @@
+import logging
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .images import delete_image_files_on_commit
+from .models import Ingredient, Recipe
+from .search import FTS_TABLE, delete_from_search_index, update_search_index
+
+logger = logging.getLogger(__name__)
+
+STATEMENTS = {
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX IF NOT EXISTS ingredient_name_trgm_idx '
+        'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops)',
+        'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+        'ON recipes_recipe USING gin (search_vector)',
+    ],
+    'sqlite': [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+        f'USING fts5(name, ingredients, description)',
+    ],
+}
+
+
+def create_database_extras(sender, using, **kwargs):
+    """
+    Объекты БД, которые нельзя описать в Meta моделей Django 2.2:
+    триграммный индекс по UPPER(name) ингредиентов для поиска
+    name__istartswith/name__icontains и GIN-индекс полнотекстового
+    поиска рецептов в PostgreSQL, таблица FTS5 для поиска в SQLite.
+    """
+    connection = connections[using]
+    for statement in STATEMENTS.get(connection.vendor, []):
+        try:
+            with transaction.atomic(using=using):
+                with connection.cursor() as cursor:
+                    cursor.execute(statement)
+        except DatabaseError as error:
+            logger.warning('%s: %s', statement, error)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search_index(instance, created, **kwargs):
+    if not created:
+        update_search_index(
+            Recipe.objects.filter(ingredients=instance).values_list(
+                'id', flat=True
+            )
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_from_search_index(instance, **kwargs):
+    delete_from_search_index([instance.id])
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image_files(instance, **kwargs):
+    delete_image_files_on_commit(instance.image.name, instance.image_width)
@@ -4,7 +4,10 @@ from .models import User
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'first_name', 'last_name', 'email', 'password')
+    list_display = (
+        'username', 'first_name', 'last_name', 'email', 'password',
+        'recipes_count', 'cart_count'
+    )
     search_fields = ('username', 'email')
     list_filter = ('username', 'email')
 
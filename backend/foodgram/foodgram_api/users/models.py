@@ -1,5 +1,30 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
+
+
+class UserQuerySet(models.QuerySet):
+
+    def with_is_subscribed(self, user):
+        """
+        Аннотация признака подписки пользователя user на каждого автора.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(
+                Subscription.objects.filter(
+                    author=OuterRef('pk'),
+                    user=user
+                )
+            )
+        )
+
+
+class FoodgramUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
 
 
 class User(AbstractUser):
@@ -17,9 +42,21 @@ class User(AbstractUser):
         max_length=254,
         unique=True
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='recipes_count',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        verbose_name='cart_count',
+        default=0,
+        editable=False,
+    )
 
     REQUIRED_FIELDS = ['last_name', 'first_name', 'email']
 
+    objects = FoodgramUserManager()
+
     class Meta:
         verbose_name = 'Пользователи'
         verbose_name_plural = 'Пользователи'
@@ -44,7 +81,13 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписки'
         verbose_name_plural = 'Подписки'
-        models.UniqueConstraint(
-            fields=['author', 'user'],
-            name='unique_subscription'
-        )
+        constraints = [
+            models.UniqueConstraint(
+                fields=['author', 'user'],
+                name='unique_subscription'
+            ),
+            models.CheckConstraint(
+                check=~models.Q(author=models.F('user')),
+                name='no_self_subscription'
+            ),
+        ]